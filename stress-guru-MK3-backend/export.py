@@ -0,0 +1,233 @@
+"""
+Streaming NDJSON export of stress_assessments for analytics.
+
+Used by the /admin/export/assessments endpoint and runnable as a CLI:
+
+    python export.py --out assessments.ndjson.gz --start 2024-01-01 --end 2024-07-01
+    python export.py --out assessments.ndjson.gz --checkpoint export.ckpt   # resumable
+    python export.py --ensure-indexes                                       # deploy step
+
+Rows are read in _id order with large cursor batches, preferably from a
+secondary, and serialised one at a time, so memory stays flat however many
+rows there are. Assessment _ids are assigned when the assessment is taken, so
+start/end are turned into _id bounds and the export walks only that slice
+of the _id index; the timestamp check stays in the filter for exactness.
+User-filtered exports and the write queue's per-user counts rely on the
+(user_id, _id) index on stress_assessments. The server doesn't build it;
+run --ensure-indexes once per deploy. Every row carries its _id. An interrupted export restarts
+after the last _id it wrote (--after-id, or the --checkpoint file which the
+CLI keeps up to date). The checkpoint also records the output size at that
+point, so rows written after it are cut off before resuming rather than
+duplicated.
+"""
+import os
+import sys
+import json
+import zlib
+import argparse
+import datetime
+
+from bson import ObjectId
+from pymongo import ReadPreference
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 5000))
+# _ids can be a little later than the timestamp they carry, so the upper
+# _id bound is padded and the timestamp predicate does the exact cut
+EXPORT_ID_SLACK = datetime.timedelta(seconds=int(os.getenv("EXPORT_ID_SLACK_SECONDS", 60)))
+EXPORT_FIELDS = {
+    "user_id": 1,
+    "timestamp": 1,
+    "responses": 1,
+    "score": 1,
+    "stress_level": 1,
+    "ai_confidence": 1,
+    "questions_answered": 1
+}
+
+
+def ensure_indexes(db):
+    """Create the indexes exports and the write queue rely on; a no-op if they exist"""
+    return [db["stress_assessments"].create_index([("user_id", 1), ("_id", 1)])]
+
+
+def parse_date(value):
+    """Parse an ISO date or datetime; None passes through"""
+    if not value:
+        return None
+    return datetime.datetime.fromisoformat(value)
+
+
+def build_export_query(start=None, end=None, user_ids=None, after_id=None):
+    """Mongo filter for the export; start is inclusive, end exclusive"""
+    query = {}
+    id_range = {}
+    if start or end:
+        query["timestamp"] = {}
+        if start:
+            query["timestamp"]["$gte"] = start
+            id_range["$gte"] = ObjectId.from_datetime(start)
+        if end:
+            query["timestamp"]["$lt"] = end
+            id_range["$lt"] = ObjectId.from_datetime(end + EXPORT_ID_SLACK)
+    if user_ids:
+        query["user_id"] = {"$in": [str(u) for u in user_ids]}
+    if after_id:
+        id_range["$gt"] = ObjectId(after_id)
+    if id_range:
+        query["_id"] = id_range
+    return query
+
+
+def iter_assessments(collection, query, batch_size=EXPORT_BATCH_SIZE):
+    """Yield matching assessments in _id order, reading from a secondary when available"""
+    collection = collection.with_options(read_preference=ReadPreference.SECONDARY_PREFERRED)
+    cursor = collection.find(query, EXPORT_FIELDS).sort("_id", 1).batch_size(batch_size)
+    try:
+        for doc in cursor:
+            yield doc
+    finally:
+        cursor.close()
+
+
+def _encode(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def to_ndjson_line(doc):
+    return (json.dumps(doc, default=_encode, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+def iter_ndjson(docs):
+    """Serialise documents to NDJSON lines (bytes)"""
+    for doc in docs:
+        yield to_ndjson_line(doc)
+
+
+def iter_gzip(chunks, level=6, flush_bytes=64 * 1024):
+    """Gzip a stream of byte chunks, emitting output roughly every flush_bytes of input"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    pending = 0
+    for chunk in chunks:
+        out = compressor.compress(chunk)
+        pending += len(chunk)
+        if pending >= flush_bytes:
+            out += compressor.flush(zlib.Z_SYNC_FLUSH)
+            pending = 0
+        if out:
+            yield out
+    yield compressor.flush()
+
+
+def export_to_file(collection, out_path, query, checkpoint_path=None, checkpoint_every=10000,
+                   compress=None, resume_offset=None):
+    """Write the export to a file. Returns the row count.
+
+    With resume_offset the file is cut back to that size and appended to;
+    otherwise it's overwritten.
+    """
+    if compress is None:
+        compress = out_path.endswith(".gz")
+
+    written = 0
+    last_id = None
+
+    if resume_offset is not None and os.path.exists(out_path):
+        out = open(out_path, "r+b")
+        out.truncate(resume_offset)
+        out.seek(resume_offset)
+    else:
+        out = open(out_path, "wb")
+
+    # Gzip output is closed off as a complete member at every checkpoint;
+    # gzip readers treat concatenated members as one stream
+    with out:
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+        for doc in iter_assessments(collection, query):
+            line = to_ndjson_line(doc)
+            out.write(compressor.compress(line) if compressor else line)
+            written += 1
+            last_id = doc["_id"]
+
+            if checkpoint_path and written % checkpoint_every == 0:
+                if compressor:
+                    out.write(compressor.flush())
+                    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+                out.flush()
+                os.fsync(out.fileno())
+                _write_checkpoint(checkpoint_path, last_id, out.tell())
+
+        if compressor:
+            out.write(compressor.flush())
+        out.flush()
+        end_offset = out.tell()
+
+    if checkpoint_path and last_id is not None:
+        _write_checkpoint(checkpoint_path, last_id, end_offset)
+    return written
+
+
+def _write_checkpoint(path, last_id, offset):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write(f"{last_id} {offset}")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_checkpoint(path):
+    """Return (last_id, output offset) from a checkpoint file, or (None, None)"""
+    if not os.path.exists(path):
+        return None, None
+    with open(path) as f:
+        parts = f.read().split()
+    if not parts:
+        return None, None
+    return parts[0], int(parts[1]) if len(parts) > 1 else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export stress assessments as NDJSON")
+    parser.add_argument("--out", help="Output file; .gz enables gzip")
+    parser.add_argument("--start", help="ISO date/datetime, inclusive")
+    parser.add_argument("--end", help="ISO date/datetime, exclusive")
+    parser.add_argument("--user", action="append", dest="users", help="Only this user_id (repeatable)")
+    parser.add_argument("--after-id", help="Resume after this assessment _id")
+    parser.add_argument("--checkpoint", help="File holding the last exported _id; read on start, updated as rows are written")
+    parser.add_argument("--ensure-indexes", action="store_true", help="Create the stress_assessments indexes first")
+    args = parser.parse_args()
+    if not args.out and not args.ensure_indexes:
+        parser.error("--out is required unless --ensure-indexes is given")
+
+    after_id, resume_offset = args.after_id, None
+    if not after_id and args.checkpoint:
+        after_id, resume_offset = read_checkpoint(args.checkpoint)
+        if after_id:
+            print(f"Resuming after {after_id}")
+    elif after_id and args.out:
+        # An explicit --after-id continues an existing file as it is
+        resume_offset = os.path.getsize(args.out) if os.path.exists(args.out) else None
+
+    from dotenv import load_dotenv
+    from pymongo import MongoClient
+    load_dotenv(dotenv_path="db.env")
+    client = MongoClient(os.getenv("MONGO_URI", "mongodb://localhost:27017/mydatabase"))
+    db = client[os.getenv("DB_NAME", "mydatabase")]
+    if args.ensure_indexes:
+        print(f"Ensured indexes: {', '.join(ensure_indexes(db))}")
+        if not args.out:
+            return
+    collection = db["stress_assessments"]
+
+    query = build_export_query(parse_date(args.start), parse_date(args.end), args.users, after_id)
+    written = export_to_file(collection, args.out, query, checkpoint_path=args.checkpoint,
+                             resume_offset=resume_offset)
+    print(f"Exported {written} assessments to {args.out}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
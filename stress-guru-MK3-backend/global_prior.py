@@ -0,0 +1,341 @@
+"""
+Periodic job that builds a population-wide prior from every user's knowledge base.
+
+The parent streams only the _ids of ai_knowledge_base, cuts them into
+ranges, and hands the ranges to a process pool. Each worker reads its own range
+over its own Mongo connection and turns it into partial counts, so the parent
+does almost nothing per document and throughput grows with the worker count:
+- level_counts[level]: total learned frequency per stress level
+- answer_counts[question][answer][level]: frequency of each answer per level
+- the most frequent distinct (responses, stress level) patterns; workers keep
+  only their chunk's heaviest hitters, so this part is approximate
+
+Every knowledge base starts from the same seed patterns, so summing them as
+they are would mostly reproduce the seeds. Each knowledge base's seed
+frequencies are subtracted first, leaving only what its user's assessments
+added: frequency increments on existing patterns plus new patterns.
+
+Chunks are encoded into numpy code arrays and tallied with np.bincount, so
+the per-pattern Python work is just the encoding. The parent sums the partial
+counts as they arrive and saves the compact result to the ai_global_prior
+collection. server.py loads it from there and AdaptiveStress20QAI blends it
+with each user's own patterns when predicting, using both the count tables
+and the representative patterns.
+
+Usage:
+    python global_prior.py                      # build and save the prior
+    python global_prior.py --workers 8
+    python global_prior.py --benchmark          # merge throughput per core count
+"""
+import os
+import time
+import argparse
+import datetime
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+
+NUM_QUESTIONS = 10
+ANSWERS = ['never', 'almost never', 'sometimes', 'fairly often', 'very often']
+STRESS_LEVELS = ['low stress', 'moderate stress', 'high stress']
+MISSING = len(ANSWERS)
+
+ANSWER_CODES = {answer: code for code, answer in enumerate(ANSWERS)}
+LEVEL_CODES = {level: code for code, level in enumerate(STRESS_LEVELS)}
+
+CHUNK_DOCS = int(os.getenv("GLOBAL_PRIOR_CHUNK_DOCS", 500))
+REPRESENTATIVES = int(os.getenv("GLOBAL_PRIOR_REPRESENTATIVES", 200))
+# Distinct patterns kept per chunk and while merging, before pruning to the most frequent
+REPRESENTATIVE_BUFFER = REPRESENTATIVES * 10
+
+_worker_collection = None
+_seed_counts = None
+
+
+def pattern_key(pattern):
+    """(answer codes..., level code) for a KB pattern, or None if its level is unknown"""
+    level = LEVEL_CODES.get(pattern.get('stress_level'))
+    if level is None:
+        return None
+    row = [MISSING] * NUM_QUESTIONS
+    for idx, resp in (pattern.get('responses') or {}).items():
+        try:
+            q = int(idx)
+        except (TypeError, ValueError):
+            continue
+        if 0 <= q < NUM_QUESTIONS:
+            row[q] = ANSWER_CODES.get(resp, MISSING)
+    return tuple(row) + (level,)
+
+
+def seed_counts():
+    """Frequency of every seed pattern a new knowledge base can start with"""
+    global _seed_counts
+    if _seed_counts is None:
+        from twentyq_ai import AdaptiveStress20QAI, load_initial_patterns
+        counts = Counter()
+        # A KB starts from one seed set or the other; a set may repeat a pattern
+        for seeds in (load_initial_patterns(), AdaptiveStress20QAI().initialize_knowledge_base()['patterns']):
+            seed_set = Counter()
+            for pattern in seeds:
+                key = pattern_key(pattern)
+                if key is not None:
+                    seed_set[key] += pattern.get('frequency', 1)
+            counts |= seed_set
+        _seed_counts = counts
+    return _seed_counts
+
+
+def encode_patterns(kb_pattern_lists, seeds=None):
+    """Flatten lists of KB patterns into (codes, levels, frequencies) arrays.
+
+    codes has one row per pattern with an answer code per question, or MISSING.
+    Each KB's seed frequencies are subtracted, so only learned counts remain;
+    patterns with nothing learned or an unknown stress level are skipped.
+    """
+    if seeds is None:
+        seeds = seed_counts()
+    codes, levels, freqs = [], [], []
+    for patterns in kb_pattern_lists:
+        unclaimed = Counter(seeds)
+        for pattern in patterns or []:
+            key = pattern_key(pattern)
+            if key is None:
+                continue
+            freq = pattern.get('frequency', 1)
+            seeded = min(freq, unclaimed[key])
+            unclaimed[key] -= seeded
+            if freq - seeded <= 0:
+                continue
+            codes.append(key[:-1])
+            levels.append(key[-1])
+            freqs.append(freq - seeded)
+
+    return (
+        np.array(codes, dtype=np.int64).reshape(-1, NUM_QUESTIONS),
+        np.array(levels, dtype=np.int64),
+        np.array(freqs, dtype=np.float64)
+    )
+
+
+def merge_chunk(kb_pattern_lists, seeds=None):
+    """Count one chunk of knowledge bases; runs in a worker process"""
+    codes, levels, freqs = encode_patterns(kb_pattern_lists, seeds)
+    n_levels = len(STRESS_LEVELS)
+    n_answers = len(ANSWERS) + 1
+
+    level_counts = np.bincount(levels, weights=freqs, minlength=n_levels)
+
+    # One flat bin per (question, answer, level); MISSING answers are dropped afterwards
+    questions = np.broadcast_to(np.arange(NUM_QUESTIONS), codes.shape)
+    flat = (questions * n_answers + codes) * n_levels + levels[:, None]
+    answer_counts = np.bincount(
+        flat.ravel(),
+        weights=np.repeat(freqs, NUM_QUESTIONS),
+        minlength=NUM_QUESTIONS * n_answers * n_levels
+    ).reshape(NUM_QUESTIONS, n_answers, n_levels)[:, :len(ANSWERS), :]
+
+    # Key each distinct pattern by its answer codes plus level
+    keys = np.concatenate([codes, levels[:, None]], axis=1).astype(np.int8)
+    patterns = Counter()
+    for key, freq in zip(map(bytes, keys), freqs):
+        patterns[key] += freq
+    if len(patterns) > REPRESENTATIVE_BUFFER:
+        patterns = Counter(dict(patterns.most_common(REPRESENTATIVE_BUFFER)))
+
+    return level_counts, answer_counts, patterns, len(levels)
+
+
+def _init_worker(mongo_uri, db_name):
+    global _worker_collection
+    from pymongo import MongoClient, ReadPreference
+    client = MongoClient(mongo_uri)
+    _worker_collection = client[db_name]["ai_knowledge_base"].with_options(
+        read_preference=ReadPreference.SECONDARY_PREFERRED
+    )
+
+
+def merge_id_range(first_id, last_id):
+    """Read and count the knowledge bases with _id in [first_id, last_id]"""
+    cursor = _worker_collection.find(
+        {"_id": {"$gte": first_id, "$lte": last_id}},
+        {"knowledge_base.patterns": 1, "_id": 0}
+    ).batch_size(CHUNK_DOCS)
+    return merge_chunk(doc.get('knowledge_base', {}).get('patterns', []) for doc in cursor)
+
+
+def merge_synthetic(seed, count):
+    """Generate and count synthetic knowledge bases, standing in for a Mongo read"""
+    return merge_chunk(synthetic_knowledge_bases(count, seed=seed))
+
+
+class PriorAccumulator:
+    """Sums partial counts from merge_chunk"""
+
+    def __init__(self):
+        self.level_counts = np.zeros(len(STRESS_LEVELS))
+        self.answer_counts = np.zeros((NUM_QUESTIONS, len(ANSWERS), len(STRESS_LEVELS)))
+        self.patterns = Counter()
+        self.documents = 0
+        self.pattern_total = 0
+
+    def add(self, result, documents):
+        level_counts, answer_counts, patterns, n_patterns = result
+        self.level_counts += level_counts
+        self.answer_counts += answer_counts
+        self.patterns.update(patterns)
+        self.documents += documents
+        self.pattern_total += n_patterns
+        if len(self.patterns) > REPRESENTATIVE_BUFFER * 2:
+            self.patterns = Counter(dict(self.patterns.most_common(REPRESENTATIVE_BUFFER)))
+
+    def representatives(self):
+        reps = []
+        for key, freq in self.patterns.most_common(REPRESENTATIVES):
+            *codes, level = key
+            reps.append({
+                'responses': {str(q): ANSWERS[c] for q, c in enumerate(codes) if c != MISSING},
+                'stress_level': STRESS_LEVELS[level],
+                'frequency': float(freq)
+            })
+        return reps
+
+    def to_document(self):
+        return {
+            "_id": "current",
+            "stress_levels": STRESS_LEVELS,
+            "answers": ANSWERS,
+            "level_counts": self.level_counts.tolist(),
+            "answer_counts": self.answer_counts.tolist(),
+            "representative_patterns": self.representatives(),
+            "knowledge_bases": self.documents,
+            "patterns": self.pattern_total,
+            "generated_at": datetime.datetime.utcnow()
+        }
+
+
+def iter_id_ranges(collection, chunk_docs=CHUNK_DOCS):
+    """Yield (first_id, last_id, count) for consecutive runs of chunk_docs _ids"""
+    cursor = collection.find({}, {"_id": 1}).sort("_id", 1).batch_size(chunk_docs * 20)
+    first_id, last_id, count = None, None, 0
+    for doc in cursor:
+        if first_id is None:
+            first_id = doc['_id']
+        last_id = doc['_id']
+        count += 1
+        if count >= chunk_docs:
+            yield first_id, last_id, count
+            first_id, count = None, 0
+    if count:
+        yield first_id, last_id, count
+
+
+def aggregate(tasks, merge_fn, workers=None, initializer=None, initargs=()):
+    """Run merge_fn(*task[:-1]) for each task across a process pool and sum the results.
+
+    The last element of each task is its document count. Only a couple of
+    tasks per worker are in flight, so tasks can come straight from a cursor.
+    """
+    workers = workers or os.cpu_count() or 1
+    acc = PriorAccumulator()
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as pool:
+        in_flight = {}
+        for *args, documents in tasks:
+            if len(in_flight) >= workers * 2:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    acc.add(future.result(), in_flight.pop(future))
+            in_flight[pool.submit(merge_fn, *args)] = documents
+
+        for future in list(in_flight):
+            acc.add(future.result(), in_flight.pop(future))
+    return acc
+
+
+def build_global_prior(mongo_uri, db_name, workers=None):
+    """Merge every knowledge base and save the prior to ai_global_prior"""
+    from pymongo import MongoClient
+    db = MongoClient(mongo_uri)[db_name]
+
+    acc = aggregate(
+        iter_id_ranges(db["ai_knowledge_base"]),
+        merge_id_range,
+        workers=workers,
+        initializer=_init_worker,
+        initargs=(mongo_uri, db_name)
+    )
+    prior = acc.to_document()
+    db["ai_global_prior"].replace_one({"_id": "current"}, prior, upsert=True)
+    return prior
+
+
+def synthetic_knowledge_bases(count, patterns_per_kb=60, seed=0):
+    """Random knowledge bases shaped like real ones, for benchmarking"""
+    rng = np.random.default_rng(seed)
+    for _ in range(count):
+        answers = rng.integers(0, len(ANSWERS), size=(patterns_per_kb, NUM_QUESTIONS))
+        levels = rng.integers(0, len(STRESS_LEVELS), size=patterns_per_kb)
+        freqs = rng.integers(1, 20, size=patterns_per_kb)
+        yield [
+            {
+                'responses': {str(q): ANSWERS[a] for q, a in enumerate(row)},
+                'stress_level': STRESS_LEVELS[level],
+                'frequency': int(freq)
+            }
+            for row, level, freq in zip(answers, levels, freqs)
+        ]
+
+
+def benchmark(kb_count, max_workers):
+    """Merge throughput for 1, 2, 4, ... workers, to check scaling with cores.
+
+    Workers generate their chunks locally in place of reading them from Mongo,
+    so the numbers include that per-document decoding cost.
+    """
+    tasks = [(seed, min(CHUNK_DOCS, kb_count - start), min(CHUNK_DOCS, kb_count - start))
+             for seed, start in enumerate(range(0, kb_count, CHUNK_DOCS))]
+    worker_counts = []
+    n = 1
+    while n < max_workers:
+        worker_counts.append(n)
+        n *= 2
+    worker_counts.append(max_workers)
+
+    print(f"{kb_count} synthetic knowledge bases")
+    print(f"{'workers':>8}{'seconds':>10}{'patterns/s':>14}{'speedup':>10}")
+    baseline = None
+    for workers in worker_counts:
+        start = time.perf_counter()
+        acc = aggregate(tasks, merge_synthetic, workers=workers)
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print(f"{workers:>8}{elapsed:>10.2f}{acc.pattern_total / elapsed:>14.0f}{baseline / elapsed:>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the global stress prior from all knowledge bases")
+    parser.add_argument('--workers', type=int, help="Worker processes (default: all cores)")
+    parser.add_argument('--benchmark', action='store_true', help="Time merges on synthetic data instead")
+    parser.add_argument('--benchmark-kbs', type=int, default=20000)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark_kbs, args.workers or os.cpu_count() or 1)
+        return
+
+    from dotenv import load_dotenv
+    load_dotenv(dotenv_path="db.env")
+
+    start = time.perf_counter()
+    prior = build_global_prior(
+        os.getenv("MONGO_URI", "mongodb://localhost:27017/mydatabase"),
+        os.getenv("DB_NAME", "mydatabase"),
+        workers=args.workers
+    )
+    print(f"Merged {prior['patterns']} patterns from {prior['knowledge_bases']} knowledge bases "
+          f"in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
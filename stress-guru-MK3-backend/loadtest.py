@@ -0,0 +1,285 @@
+"""
+Load test harness for the StressGuru backend.
+
+Replays the assessment flow used by the frontend (App.js):
+register/login, repeated /pss/next-question, /pss/assess, /pss/history.
+Answers are drawn from initial_patterns.json weighted by pattern frequency,
+so the request mix looks like real traffic.
+
+Usage:
+    python loadtest.py --users 2000 --concurrency 64
+    python loadtest.py --url http://localhost:5001 --users 500
+
+Without --url the server is started in a separate process against mongomock,
+a local Mongo stand-in (pip install mongomock), so the load generator's
+threads don't share its GIL. Its access log is switched off.
+
+A 503 (password hashing pool or write queue full) is retried after its
+Retry-After, up to --max-retries times, and counted in the 503s column rather
+than as an error. Latency percentiles only cover the final attempt. Many 503s
+on /register and /login mean PASSWORD_POOL_WORKERS/PASSWORD_POOL_QUEUE are set
+lower than the concurrency being tested.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+import subprocess
+import urllib.request
+import urllib.error
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+RESPONSE_OPTIONS = ['never', 'almost never', 'sometimes', 'fairly often', 'very often']
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PATTERNS_PATH = os.path.join(SCRIPT_DIR, 'initial_patterns.json')
+
+
+def load_answer_profiles(path=PATTERNS_PATH):
+    """Load (responses, frequency) pairs used to draw realistic answers"""
+    with open(path, 'r') as f:
+        patterns = json.load(f)['patterns']
+    profiles = [p['responses'] for p in patterns]
+    weights = [p.get('frequency', 1) for p in patterns]
+    return profiles, weights
+
+
+class RouteStats:
+    """Thread-safe latency and status recorder, keyed by route"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.rejected = defaultdict(int)
+
+    def record(self, route, elapsed, ok):
+        with self.lock:
+            self.latencies[route].append(elapsed)
+            if not ok:
+                self.errors[route] += 1
+
+    def record_rejected(self, route):
+        with self.lock:
+            self.rejected[route] += 1
+
+    @staticmethod
+    def percentile(sorted_values, pct):
+        if not sorted_values:
+            return 0.0
+        k = (len(sorted_values) - 1) * pct / 100.0
+        lower = int(k)
+        upper = min(lower + 1, len(sorted_values) - 1)
+        return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (k - lower)
+
+    def report(self, wall_time):
+        lines = []
+        header = f"{'route':<22}{'count':>8}{'errors':>8}{'503s':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+        lines.append(header)
+        lines.append('-' * len(header))
+        total = 0
+        for route in sorted(self.latencies):
+            values = sorted(self.latencies[route])
+            total += len(values)
+            lines.append(
+                f"{route:<22}{len(values):>8}{self.errors[route]:>8}{self.rejected[route]:>8}"
+                f"{len(values) / wall_time:>10.1f}"
+                f"{self.percentile(values, 50) * 1000:>10.1f}"
+                f"{self.percentile(values, 95) * 1000:>10.1f}"
+                f"{self.percentile(values, 99) * 1000:>10.1f}"
+            )
+        lines.append('-' * len(header))
+        lines.append(f"total requests: {total} in {wall_time:.1f}s ({total / wall_time:.1f} req/s), "
+                     f"{sum(self.rejected.values())} retried after 503")
+        return "\n".join(lines)
+
+
+class VirtualUser:
+    """One simulated client running the full assessment flow"""
+
+    def __init__(self, base_url, stats, profiles, weights, user_no, timeout=30, max_retries=10):
+        self.base_url = base_url.rstrip('/')
+        self.stats = stats
+        self.profiles = profiles
+        self.weights = weights
+        self.email = f"loadtest-{user_no}-{random.getrandbits(32):08x}@example.com"
+        self.password = "loadtest-password"
+        self.token = None
+        self.timeout = timeout
+        self.max_retries = max_retries
+
+    def request(self, route, method='GET', payload=None):
+        headers = {'Content-Type': 'application/json'}
+        if self.token:
+            headers['x-access-token'] = self.token
+        body = json.dumps(payload).encode('utf-8') if payload is not None else None
+        req = urllib.request.Request(self.base_url + route, data=body, headers=headers, method=method)
+
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(req, timeout=self.timeout) as resp:
+                    data = resp.read()
+                    status = resp.status
+            except urllib.error.HTTPError as e:
+                data = e.read()
+                status = e.code
+                if status == 503 and attempt < self.max_retries:
+                    self.stats.record_rejected(route)
+                    try:
+                        retry_after = float(e.headers.get('Retry-After', 1))
+                    except ValueError:
+                        retry_after = 1.0
+                    # Jitter so rejected users don't come back in lockstep
+                    time.sleep(retry_after * random.uniform(0.5, 1.5))
+                    continue
+            except Exception:
+                self.stats.record(route, time.perf_counter() - start, False)
+                return None, None
+            break
+        self.stats.record(route, time.perf_counter() - start, status < 400)
+
+        try:
+            return status, json.loads(data) if data else {}
+        except ValueError:
+            return status, None
+
+    def answer_for(self, profile, question_idx):
+        """Answer from the chosen profile, with some noise like real users"""
+        answer = profile.get(str(question_idx))
+        if answer is None or random.random() < 0.15:
+            return random.choice(RESPONSE_OPTIONS)
+        return answer
+
+    def run(self, assessments=1):
+        status, _ = self.request('/register', 'POST', {
+            'email': self.email,
+            'password': self.password,
+            'username': self.email.split('@')[0]
+        })
+        if status is None or status >= 400:
+            return False
+
+        status, data = self.request('/login', 'POST', {'email': self.email, 'password': self.password})
+        if status != 200 or not data or 'token' not in data:
+            return False
+        self.token = data['token']
+
+        for _ in range(assessments):
+            profile = random.choices(self.profiles, weights=self.weights, k=1)[0]
+            current_responses = []
+
+            while True:
+                status, data = self.request('/pss/next-question', 'POST', {'current_responses': current_responses})
+                if status != 200 or not data or data.get('complete'):
+                    break
+                idx = data.get('question_index')
+                if idx is None or any(i == idx for i, _ in current_responses):
+                    break
+                current_responses.append([idx, self.answer_for(profile, idx)])
+
+            if current_responses:
+                self.request('/pss/assess', 'POST', {'responses': current_responses})
+            self.request('/pss/history')
+        return True
+
+
+def serve_local(port):
+    """Run server.py on a mongomock backend without an access log; used by start_local_server"""
+    try:
+        import mongomock
+    except ImportError:
+        print("mongomock is required for a local run (pip install mongomock), or pass --url")
+        sys.exit(1)
+
+    import pymongo
+    pymongo.MongoClient = mongomock.MongoClient
+
+    from werkzeug.serving import make_server, WSGIRequestHandler
+    import server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    make_server('127.0.0.1', port, server.app, threaded=True, request_handler=QuietHandler).serve_forever()
+
+
+def start_local_server(port, timeout=30):
+    """Start the mongomock-backed server in a child process and wait until it answers"""
+    env = dict(os.environ)
+    env.setdefault("WRITE_QUEUE_JOURNAL", os.path.join(tempfile.mkdtemp(prefix="loadtest-"), "write_queue"))
+    proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', '--port', str(port)],
+                            cwd=SCRIPT_DIR, env=env)
+    base_url = f"http://127.0.0.1:{port}"
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            sys.exit(f"Local server exited with code {proc.returncode}")
+        try:
+            urllib.request.urlopen(base_url + '/pss/questions', timeout=1)
+            break
+        except urllib.error.HTTPError:
+            # Any HTTP answer, 401 included, means it is up
+            break
+        except OSError:
+            time.sleep(0.1)
+    else:
+        proc.terminate()
+        sys.exit(f"Local server did not start within {timeout}s")
+    return proc, base_url
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay the StressGuru assessment flow at scale")
+    parser.add_argument('--url', help="Target server; omit to run server.py in a child process on mongomock")
+    parser.add_argument('--port', type=int, default=int(os.getenv("LOADTEST_PORT", 5099)))
+    parser.add_argument('--users', type=int, default=1000, help="Number of virtual users")
+    parser.add_argument('--concurrency', type=int, default=50, help="Virtual users running at once")
+    parser.add_argument('--assessments', type=int, default=1, help="Assessments per virtual user")
+    parser.add_argument('--max-retries', type=int, default=10, help="Retries per request after a 503")
+    parser.add_argument('--patterns', default=PATTERNS_PATH)
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve_local(args.port)
+        return
+
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    profiles, weights = load_answer_profiles(args.patterns)
+
+    server_proc = None
+    base_url = args.url
+    if not base_url:
+        server_proc, base_url = start_local_server(args.port)
+
+    stats = RouteStats()
+    print(f"Running {args.users} virtual users ({args.concurrency} concurrent) against {base_url}")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(
+            lambda n: VirtualUser(base_url, stats, profiles, weights, n, max_retries=args.max_retries).run(args.assessments),
+            range(args.users)
+        ))
+    wall_time = time.perf_counter() - start
+
+    print(stats.report(wall_time))
+    print(f"completed flows: {sum(1 for r in results if r)}/{args.users}")
+
+    if server_proc is not None:
+        server_proc.terminate()
+        server_proc.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+Bounded worker pool for password hashing and verification.
+
+Hashing is deliberately slow, so /register, /login and /reset-password hand it
+to a small dedicated pool instead of running it on the request workers. At most
+PASSWORD_POOL_WORKERS hashes run at once and PASSWORD_POOL_QUEUE more may wait;
+anything beyond that is rejected with HashPoolOverloaded so the server can
+answer 503 instead of letting an auth burst starve the assessment endpoints.
+
+The KDF is set with PASSWORD_HASH_METHOD in werkzeug's method syntax, e.g.
+"scrypt:32768:8:1" or "pbkdf2:sha256:600000". Hashes made with an older method,
+including the legacy salted "sha256$" format, still verify and are flagged for
+rehashing on the next successful login.
+
+Benchmark work factors on the target hardware with:
+    python password_pool.py
+"""
+import os
+import hmac
+import time
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+
+DEFAULT_HASH_METHOD = "scrypt:32768:8:1"
+
+
+class HashPoolOverloaded(Exception):
+    """Raised when the hashing queue is full"""
+
+    def __init__(self, retry_after):
+        super().__init__("Password hashing pool is overloaded")
+        self.retry_after = retry_after
+
+
+def normalise_hash_method(method):
+    """Expand a method the way werkzeug does, e.g. "scrypt" -> "scrypt:32768:8:1".
+
+    This is the prefix werkzeug writes into hashes made with the method. Raises
+    ValueError for methods werkzeug would reject.
+    """
+    name, *args = method.split(":")
+    try:
+        if name == "scrypt":
+            n, r, p = map(int, args) if args else (2 ** 15, 8, 1)
+            return f"scrypt:{n}:{r}:{p}"
+        if name == "pbkdf2" and len(args) <= 2:
+            hash_name = args[0] if args else "sha256"
+            iterations = int(args[1]) if len(args) == 2 else DEFAULT_PBKDF2_ITERATIONS
+            hashlib.new(hash_name)
+            return f"pbkdf2:{hash_name}:{iterations}"
+    except ValueError:
+        pass
+    raise ValueError(f"Invalid hash method '{method}'.")
+
+
+def check_legacy_sha256_hash(pwhash, password):
+    """Verify hashes made by old werkzeug with method='sha256' (salt$hmac-sha256 hex)"""
+    try:
+        method, salt, hashval = pwhash.split("$", 2)
+    except ValueError:
+        return False
+    if method != "sha256":
+        return False
+    expected = hmac.new(salt.encode('utf-8'), password.encode('utf-8'), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, hashval)
+
+
+class PasswordHashPool:
+    def __init__(self, method=DEFAULT_HASH_METHOD, workers=2, max_queue=32, retry_after=2):
+        self.method = method
+        self.retry_after = retry_after
+        # werkzeug expands short forms like "scrypt" or "pbkdf2", so compare
+        # against the prefix it actually writes; this also fails fast on an invalid method
+        self.hash_prefix = normalise_hash_method(method)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        # Running plus waiting jobs; acquiring fails fast once the queue is full
+        self.slots = threading.BoundedSemaphore(workers + max_queue)
+
+    def _submit(self, fn, *args):
+        if not self.slots.acquire(blocking=False):
+            raise HashPoolOverloaded(self.retry_after)
+        try:
+            future = self.executor.submit(fn, *args)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future.result()
+
+    def hash(self, password):
+        return self._submit(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        if pwhash.startswith("sha256$"):
+            return self._submit(check_legacy_sha256_hash, pwhash, password)
+        return self._submit(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """True if the hash wasn't made with the configured method"""
+        return pwhash.split("$", 1)[0] != self.hash_prefix
+
+
+def benchmark(methods, password="benchmark-password", rounds=5):
+    """Time generate_password_hash for each method, in milliseconds per hash"""
+    results = []
+    for method in methods:
+        start = time.perf_counter()
+        for _ in range(rounds):
+            generate_password_hash(password, method)
+        results.append((method, (time.perf_counter() - start) * 1000 / rounds))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark password hashing work factors")
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--method', action='append', help="Method to time (repeatable)")
+    args = parser.parse_args()
+
+    methods = args.method or [
+        "pbkdf2:sha256:260000",
+        "pbkdf2:sha256:600000",
+        "scrypt:16384:8:1",
+        "scrypt:32768:8:1",
+        "scrypt:65536:8:1",
+    ]
+    configured = os.getenv("PASSWORD_HASH_METHOD", DEFAULT_HASH_METHOD)
+
+    print(f"{'method':<26}{'ms/hash':>10}{'hashes/s/core':>16}")
+    for method, ms in benchmark(methods, rounds=args.rounds):
+        marker = "  <- configured" if method == configured else ""
+        print(f"{method:<26}{ms:>10.1f}{1000 / ms:>16.1f}{marker}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""
+Opt-in per-request profiling.
+
+A request is profiled when either
+- it's picked by PROFILE_SAMPLE_RATE (0.0-1.0, default 0), or
+- it sends an X-Profile-Token header matching PROFILE_TOKEN (disabled if unset).
+
+While a profiled handler runs, a sampler thread records its call stack every
+PROFILE_INTERVAL_MS and writes them in collapsed-stack format (one
+"frame;frame;frame count" line per stack), ready for flamegraph.pl or
+speedscope. Sections wrapped in timed() are saved to a .json file next to
+the stacks. They're only returned in a Server-Timing header to requests with
+a valid X-Profile-Token, so sampled requests from ordinary clients don't see
+internal timings.
+
+Files go to PROFILE_DIR. Once the directory grows past PROFILE_MAX_BYTES the
+oldest profiles are removed.
+"""
+import os
+import sys
+import hmac
+import json
+import time
+import random
+import datetime
+import threading
+from functools import wraps
+from collections import defaultdict
+from contextlib import contextmanager
+
+from flask import request
+
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0))
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", 1)) / 1000
+PROFILE_MAX_BYTES = int(os.getenv("PROFILE_MAX_BYTES", 50 * 1024 * 1024))
+
+_state = threading.local()
+
+
+class StackSampler:
+    """Samples one thread's stack on a background thread"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = defaultdict(int)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(stack))] += 1
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+
+@contextmanager
+def timed(name):
+    """Record how long a section takes, if the current request is being profiled"""
+    timings = getattr(_state, 'timings', None)
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.append((name, (time.perf_counter() - start) * 1000))
+
+
+def token_authorised():
+    """True if the request carries the configured X-Profile-Token"""
+    token = request.headers.get('X-Profile-Token')
+    return bool(token and PROFILE_TOKEN and hmac.compare_digest(token, PROFILE_TOKEN))
+
+
+def sampled():
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def rotate(directory, max_bytes):
+    """Delete the oldest files until the directory fits in max_bytes"""
+    entries = []
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+def write_profile(sampler, timings, elapsed_ms, user):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    stamp = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S%f")
+    endpoint = (request.endpoint or "unknown").replace(".", "_")
+    base = os.path.join(PROFILE_DIR, f"{stamp}-{endpoint}")
+
+    with open(base + ".folded", 'w') as f:
+        f.write(sampler.collapsed())
+    with open(base + ".json", 'w') as f:
+        json.dump({
+            "path": request.path,
+            "method": request.method,
+            "user_id": str(user['_id']) if isinstance(user, dict) and '_id' in user else None,
+            "elapsed_ms": round(elapsed_ms, 3),
+            "timings_ms": [[name, round(ms, 3)] for name, ms in timings],
+            "samples": sum(sampler.stacks.values())
+        }, f, indent=2)
+
+    rotate(PROFILE_DIR, PROFILE_MAX_BYTES)
+
+
+def profiled(f):
+    """Profile the wrapped handler when sampling or an authorised header asks for it"""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        authorised = token_authorised()
+        if not authorised and not sampled():
+            return f(*args, **kwargs)
+
+        _state.timings = []
+        sampler = StackSampler(threading.get_ident(), PROFILE_INTERVAL)
+        sampler.start()
+        start = time.perf_counter()
+        try:
+            rv = f(*args, **kwargs)
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            sampler.stop()
+            timings = _state.timings
+            _state.timings = None
+
+        try:
+            write_profile(sampler, timings, elapsed_ms, args[0] if args else None)
+        except Exception as e:
+            print(f"Error writing profile: {str(e)}")
+
+        # Handlers return either a response or a (response, status) tuple
+        response = rv[0] if isinstance(rv, tuple) else rv
+        if authorised and hasattr(response, 'headers'):
+            entries = [f'{name};dur={ms:.2f}' for name, ms in timings]
+            entries.append(f'total;dur={elapsed_ms:.2f}')
+            response.headers['Server-Timing'] = ", ".join(entries)
+        return rv
+    return decorated
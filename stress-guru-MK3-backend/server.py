@@ -1,22 +1,30 @@
 import os
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
+import pymongo
 from pymongo import MongoClient
-from werkzeug.security import generate_password_hash, check_password_hash
+import threading
 import jwt
 import datetime
 import warnings
 import json
+import hashlib
+import time
+import atexit
 from functools import wraps
 from collections import defaultdict
 
-# Import the new AI system
-from twentyq_ai import AdaptiveStress20QAI
-
-# Load environment variables
+# Load environment variables before the local modules read their settings
 from dotenv import load_dotenv
 load_dotenv(dotenv_path="db.env")
 
+# Import the new AI system
+from twentyq_ai import AdaptiveStress20QAI, load_initial_patterns
+from write_queue import WriteQueue, WriteQueueFull
+from password_pool import PasswordHashPool, HashPoolOverloaded, DEFAULT_HASH_METHOD
+from profiling import profiled, timed
+from export import build_export_query, iter_assessments, iter_ndjson, iter_gzip, parse_date
+
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app, origins=os.getenv("FRONTEND_URL", "http://localhost:3000"), supports_credentials=True)
@@ -24,17 +32,154 @@ CORS(app, origins=os.getenv("FRONTEND_URL", "http://localhost:3000"), supports_c
 # Secret key for JWT
 app.config['SECRET_KEY'] = os.getenv("SECRET_KEY", "your_secret_key")
 
-# MongoDB setup
+# MongoDB setup, deferred until the first query so imports stay fast
 mongo_uri = os.getenv("MONGO_URI", "mongodb://localhost:27017/mydatabase")
-client = MongoClient(mongo_uri)
-db = client[os.getenv("DB_NAME", "mydatabase")]
-users_collection = db["users"]
-assessments_collection = db["stress_assessments"]
-knowledge_base_collection = db["ai_knowledge_base"]
+_db = None
+_db_lock = threading.Lock()
+
+def get_db():
+    """Connect to MongoDB on first use"""
+    global _db
+    if _db is None:
+        with _db_lock:
+            if _db is None:
+                # Indexes are created at deploy time with `python export.py --ensure-indexes`
+                client = MongoClient(mongo_uri)
+                _db = client[os.getenv("DB_NAME", "mydatabase")]
+    return _db
+
+class LazyCollection:
+    """Stands in for a pymongo collection until it's first used"""
+
+    def __init__(self, name):
+        self.name = name
+        self._collection = None
+
+    def __getattr__(self, attr):
+        if self._collection is None:
+            self._collection = get_db()[self.name]
+        return getattr(self._collection, attr)
+
+users_collection = LazyCollection("users")
+assessments_collection = LazyCollection("stress_assessments")
+knowledge_base_collection = LazyCollection("ai_knowledge_base")
+global_prior_collection = LazyCollection("ai_global_prior")
 
 # Initialize AI system
 ai_system = AdaptiveStress20QAI()
 
+# Population prior written by global_prior.py, re-read every GLOBAL_PRIOR_REFRESH seconds
+GLOBAL_PRIOR_REFRESH = float(os.getenv("GLOBAL_PRIOR_REFRESH", 600))
+GLOBAL_PRIOR_STRENGTH = float(os.getenv("GLOBAL_PRIOR_STRENGTH", 5.0))
+_global_prior = {"value": None, "loaded_at": None}
+
+def get_global_prior():
+    """Return the cached global prior, or None if the job hasn't produced one"""
+    now = time.monotonic()
+    loaded_at = _global_prior["loaded_at"]
+    if loaded_at is None or now - loaded_at > GLOBAL_PRIOR_REFRESH:
+        try:
+            _global_prior["value"] = global_prior_collection.find_one(
+                {"_id": "current"},
+                {"stress_levels": 1, "answers": 1, "level_counts": 1, "answer_counts": 1,
+                 "representative_patterns": 1}
+            )
+        except Exception as e:
+            print(f"Error loading global prior: {str(e)}")
+        _global_prior["loaded_at"] = now
+    return _global_prior["value"]
+
+# Assessment and knowledge base writes are journaled and flushed in the background.
+# Each process claims its own journal slot under WRITE_QUEUE_JOURNAL.
+write_queue = WriteQueue(
+    os.getenv("WRITE_QUEUE_JOURNAL", "write_queue"),
+    assessments_collection,
+    knowledge_base_collection,
+    users_collection,
+    batch_size=int(os.getenv("WRITE_QUEUE_BATCH_SIZE", 500)),
+    flush_interval=float(os.getenv("WRITE_QUEUE_FLUSH_INTERVAL", 0.5)),
+    max_depth=int(os.getenv("WRITE_QUEUE_MAX_DEPTH", 10000)),
+    max_attempts=int(os.getenv("WRITE_QUEUE_MAX_ATTEMPTS", 5)),
+    retry_after=int(os.getenv("WRITE_QUEUE_RETRY_AFTER", 2))
+)
+atexit.register(write_queue.stop)
+
+# Password hashing runs on its own bounded pool so auth bursts can't starve other routes
+password_pool = PasswordHashPool(
+    method=os.getenv("PASSWORD_HASH_METHOD", DEFAULT_HASH_METHOD),
+    workers=int(os.getenv("PASSWORD_POOL_WORKERS", 2)),
+    max_queue=int(os.getenv("PASSWORD_POOL_QUEUE", 32)),
+    retry_after=int(os.getenv("PASSWORD_POOL_RETRY_AFTER", 2))
+)
+
+def overloaded_response(e):
+    """503 with Retry-After for when the password hashing pool or write queue is full"""
+    response = jsonify({"message": "Server is busy, please try again shortly."})
+    response.status_code = 503
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+# Pre-encoded body for the static question list, served with a strong ETag
+QUESTIONS_BODY = json.dumps({
+    "questions": ai_system.questions,
+    "reverse_score_questions": ai_system.reverse_score_questions
+}).encode('utf-8')
+QUESTIONS_ETAG = hashlib.sha256(QUESTIONS_BODY).hexdigest()[:32]
+
+def cached_json_response(body, etag, cache_control, weak=False):
+    """Serve a pre-encoded JSON body, or 304 if the client's ETag still matches"""
+    if weak:
+        not_modified = request.if_none_match.contains_weak(etag)
+    else:
+        not_modified = request.if_none_match.contains(etag)
+
+    response = Response(None if not_modified else body, status=304 if not_modified else 200, mimetype='application/json')
+    response.set_etag(etag, weak=weak)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+def assessment_stats(user):
+    """Return the user's assessment count and latest assessment time.
+
+    Both values are kept on the user document by the write queue, so this
+    doesn't touch stress_assessments. Older users without them are backfilled once.
+    Still-queued assessments are counted too; they're read before the user document
+    so an assessment being flushed meanwhile is never missed.
+    """
+    pending = write_queue.pending_assessments(user['_id'])
+    user = users_collection.find_one(
+        {"_id": user['_id']},
+        {"assessment_count": 1, "last_assessment_at": 1}
+    ) or user
+    count = user.get('assessment_count')
+    last = user.get('last_assessment_at')
+
+    if count is None:
+        count = assessments_collection.count_documents({"user_id": str(user['_id'])})
+        latest = assessments_collection.find_one(
+            {"user_id": str(user['_id'])},
+            {"timestamp": 1},
+            sort=[("timestamp", -1)]
+        )
+        last = latest['timestamp'] if latest else None
+        backfill = {"assessment_count": count}
+        if last is not None:
+            backfill["last_assessment_at"] = last
+        # $max so a flush that lands meanwhile isn't rolled back
+        users_collection.update_one({"_id": user['_id']}, {"$max": backfill})
+
+    for assessment in pending:
+        count += 1
+        if last is None or assessment['timestamp'] > last:
+            last = assessment['timestamp']
+    return count, last
+
+def history_etag(user):
+    """Build the history ETag from the user's assessment count and latest timestamp"""
+    count, last = assessment_stats(user)
+    last_stamp = last.isoformat() if last else "none"
+    return f"{user['_id']}-{count}-{last_stamp}"
+
 # Modified initialize_user_knowledge_base function in server.py
 def initialize_user_knowledge_base(user_id):
     """Initialize a new user's knowledge base in MongoDB if it doesn't exist."""
@@ -42,13 +187,10 @@ def initialize_user_knowledge_base(user_id):
         existing_kb = knowledge_base_collection.find_one({"user_id": str(user_id)})
         
         if not existing_kb:
-            with open('initial_patterns.json', 'r') as f:
-                patterns_data = json.load(f)
-            
             initial_kb = {
                 "user_id": str(user_id),
                 "knowledge_base": {
-                    "patterns": patterns_data["patterns"]
+                    "patterns": load_initial_patterns()
                 },
                 "question_weights": {str(i): 1.0 for i in range(10)},
                 "historical_data": [],
@@ -80,11 +222,25 @@ def token_required(f):
         return f(current_user, *args, **kwargs)
     return decorated
 
+# Admins are listed in ADMIN_EMAILS (comma separated) or flagged with is_admin
+ADMIN_EMAILS = {e.strip() for e in os.getenv("ADMIN_EMAILS", "").split(",") if e.strip()}
+
+def admin_required(f):
+    @wraps(f)
+    @token_required
+    def decorated(current_user, *args, **kwargs):
+        if not current_user or not (current_user.get('is_admin') or current_user.get('email') in ADMIN_EMAILS):
+            return jsonify({"message": "Admin access required!"}), 403
+        return f(current_user, *args, **kwargs)
+    return decorated
+
 # Modified load_user_knowledge_base function
 def load_user_knowledge_base(user_id):
-    """Load a user's knowledge base from MongoDB"""
+    """Load a user's knowledge base, preferring a save that is still queued"""
     try:
-        kb_data = knowledge_base_collection.find_one({"user_id": str(user_id)})
+        kb_data = write_queue.pending_knowledge_base(user_id)
+        if kb_data is None:
+            kb_data = knowledge_base_collection.find_one({"user_id": str(user_id)})
         if kb_data:
             ai_system.knowledge_base = kb_data.get('knowledge_base', ai_system.initialize_knowledge_base())
             ai_system.question_weights = kb_data.get('question_weights', {str(i): 1.0 for i in range(10)})
@@ -99,7 +255,7 @@ def load_user_knowledge_base(user_id):
 
 # Modified save_user_knowledge_base function
 def save_user_knowledge_base(user_id):
-    """Save a user's knowledge base to MongoDB"""
+    """Queue a save of the user's knowledge base to MongoDB"""
     try:
         kb_data = {
             "user_id": str(user_id),
@@ -108,11 +264,7 @@ def save_user_knowledge_base(user_id):
             "historical_data": ai_system.historical_data,
             "last_updated": datetime.datetime.utcnow()
         }
-        knowledge_base_collection.update_one(
-            {"user_id": str(user_id)},
-            {"$set": kb_data},
-            upsert=True
-        )
+        write_queue.enqueue_knowledge_base(kb_data)
         return True
     except Exception as e:
         print(f"Error saving knowledge base: {str(e)}")
@@ -122,13 +274,11 @@ def save_user_knowledge_base(user_id):
 @token_required
 def get_questions(current_user):
     """Get all PSS questions"""
-    return jsonify({
-        "questions": ai_system.questions,
-        "reverse_score_questions": ai_system.reverse_score_questions
-    })
+    return cached_json_response(QUESTIONS_BODY, QUESTIONS_ETAG, "private, max-age=86400")
 
 @app.route('/pss/next-question', methods=['POST'])
 @token_required
+@profiled
 def get_next_question(current_user):
     """Get the next question for the assessment"""
     try:
@@ -145,7 +295,8 @@ def get_next_question(current_user):
             
         # Load user's knowledge base with error handling
         try:
-            load_user_knowledge_base(current_user['_id'])
+            with timed('load_user_knowledge_base'):
+                load_user_knowledge_base(current_user['_id'])
         except Exception as e:
             print(f"Knowledge base load error: {str(e)}")
             # Continue with default AI system state if knowledge base load fails
@@ -153,7 +304,8 @@ def get_next_question(current_user):
             
         # Get next question with error handling
         try:
-            next_question_idx = ai_system.get_next_question(current_responses)
+            with timed('get_next_question'):
+                next_question_idx = ai_system.get_next_question(current_responses)
             
             # Check if assessment is complete
             if next_question_idx is None:
@@ -194,6 +346,7 @@ def get_next_question(current_user):
 
 @app.route('/pss/assess', methods=['POST'])
 @token_required
+@profiled
 def assess_stress(current_user):
     """Process stress assessment responses"""
     try:
@@ -206,6 +359,10 @@ def assess_stress(current_user):
         if not responses:
             return jsonify({"message": "No responses provided"}), 400
 
+        # Shed load before doing any work if the write queue can't take the result
+        if write_queue.is_full():
+            return overloaded_response(WriteQueueFull(write_queue.retry_after))
+
         # Input validation
         if not isinstance(responses, list):
             return jsonify({"message": "Responses must be a list"}), 400
@@ -219,7 +376,8 @@ def assess_stress(current_user):
                 return jsonify({"message": f"Invalid response value: {response}"}), 400
 
         # Load user's knowledge base
-        load_user_knowledge_base(current_user['_id'])
+        with timed('load_user_knowledge_base'):
+            load_user_knowledge_base(current_user['_id'])
         
         # Initialize score calculation
         total_score = 0
@@ -249,7 +407,17 @@ def assess_stress(current_user):
         
         # Get prediction from AI
         try:
-            prediction, confidence = ai_system.predict_stress_level(responses)
+            ai_system.global_prior = get_global_prior()
+            ai_system.prior_strength = GLOBAL_PRIOR_STRENGTH
+            user_assessments = current_user.get('assessment_count')
+            if user_assessments is None:
+                # Users from before the counter existed are backfilled rather than treated as new
+                user_assessments, _ = assessment_stats(current_user)
+            with timed('predict_stress_level'):
+                prediction, confidence = ai_system.predict_stress_level(
+                    responses,
+                    user_assessments=user_assessments
+                )
         except Exception as e:
             print(f"AI prediction error: {str(e)}")
             return jsonify({"message": "Error generating AI prediction"}), 500
@@ -257,23 +425,27 @@ def assess_stress(current_user):
         # Update AI knowledge base
         try:
             ai_system.update_knowledge_base(responses, prediction)
-            save_user_knowledge_base(current_user['_id'])
+            with timed('save_user_knowledge_base'):
+                save_user_knowledge_base(current_user['_id'])
         except Exception as e:
             print(f"Knowledge base update error: {str(e)}")
             # Don't return error here, as the assessment is still valid
 
         # Store assessment in database
         try:
+            assessment_time = datetime.datetime.utcnow()
             assessment_data = {
                 "user_id": str(current_user['_id']),
-                "timestamp": datetime.datetime.utcnow(),
+                "timestamp": assessment_time,
                 "responses": responses,
                 "score": total_score,
                 "stress_level": prediction,
                 "ai_confidence": confidence,
                 "questions_answered": questions_answered
             }
-            assessments_collection.insert_one(assessment_data)
+            write_queue.enqueue_assessment(assessment_data)
+        except WriteQueueFull as e:
+            return overloaded_response(e)
         except Exception as e:
             print(f"Database storage error: {str(e)}")
             return jsonify({"message": "Error storing assessment"}), 500
@@ -291,10 +463,17 @@ def assess_stress(current_user):
 
 @app.route('/pss/history', methods=['GET'])
 @token_required
+@profiled
 def get_assessment_history(current_user):
     """Get user's assessment history"""
     try:
-        history = list(assessments_collection.find(
+        etag = history_etag(current_user)
+        if request.if_none_match.contains_weak(etag):
+            return cached_json_response(None, etag, "private, no-cache", weak=True)
+
+        # Snapshot queued assessments first; any flushed meanwhile are deduplicated by _id
+        pending = write_queue.pending_assessments(current_user['_id'])
+        stored = list(assessments_collection.find(
             {"user_id": str(current_user['_id'])},
             {
                 "responses": 1,
@@ -302,16 +481,22 @@ def get_assessment_history(current_user):
                 "stress_level": 1,
                 "timestamp": 1,
                 "ai_confidence": 1,
-                "questions_answered": 1,
-                "_id": 0
+                "questions_answered": 1
             }
         ).sort("timestamp", -1))
+
+        stored_ids = {entry['_id'] for entry in stored}
+        pending = [entry for entry in pending if entry['_id'] not in stored_ids]
+        history = sorted(pending, key=lambda entry: entry['timestamp'], reverse=True) + stored
+        
+        fields = ("responses", "score", "stress_level", "timestamp", "ai_confidence", "questions_answered")
+        history = [{k: entry[k] for k in fields if k in entry} for entry in history]
         
         # Convert timestamp to string for JSON serialization
         for entry in history:
             entry['timestamp'] = entry['timestamp'].isoformat()
             
-        return jsonify({"history": history})
+        return cached_json_response(json.dumps({"history": history}), etag, "private, no-cache", weak=True)
     except Exception as e:
         return jsonify({"message": f"An error occurred: {str(e)}"}), 500
     
@@ -344,7 +529,7 @@ def register():
             return jsonify({"message": "User already exists"}), 400
 
         # Create user
-        hashed_password = generate_password_hash(password, method='sha256')
+        hashed_password = password_pool.hash(password)
         result = users_collection.insert_one({
             "email": email,
             "username": username,  
@@ -365,6 +550,8 @@ def register():
             "user_id": str(result.inserted_id)
         }), 201
         
+    except HashPoolOverloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         print(f"Registration error: {str(e)}")
         return jsonify({"message": f"Registration failed: {str(e)}"}), 500
@@ -380,15 +567,27 @@ def login():
         if not user:
             return jsonify({"message": "Invalid email or password."}), 401
 
-        if not check_password_hash(user['password'], password):
+        if not password_pool.verify(user['password'], password):
             return jsonify({"message": "Invalid email or password."}), 401
 
+        # Upgrade hashes made with an older KDF while we have the plaintext
+        if password_pool.needs_rehash(user['password']):
+            try:
+                users_collection.update_one(
+                    {"_id": user['_id']},
+                    {"$set": {"password": password_pool.hash(password)}}
+                )
+            except HashPoolOverloaded:
+                pass
+
         token = jwt.encode({
             'email': email,
             'exp': datetime.datetime.utcnow() + datetime.timedelta(hours=24)
         }, app.config['SECRET_KEY'], algorithm="HS256")
 
         return jsonify({"token": token}), 200
+    except HashPoolOverloaded as e:
+        return overloaded_response(e)
     except:
         return jsonify({"message": "An error occurred."}), 500
 
@@ -417,17 +616,64 @@ def reset_password():
             return jsonify({"message": "Email not registered."}), 404
 
         # Check if new password is different from old
-        if check_password_hash(user['password'], new_password):
+        if password_pool.verify(user['password'], new_password):
             return jsonify({"message": "New password must not match the old password."}), 400
 
         # Hash and update the new password
-        hashed_password = generate_password_hash(new_password, method='sha256')
+        hashed_password = password_pool.hash(new_password)
         users_collection.update_one({"email": email}, {"$set": {"password": hashed_password}})
         return jsonify({"message": "Password reset successfully."}), 200
 
+    except HashPoolOverloaded as e:
+        return overloaded_response(e)
     except:
         return jsonify({"message": "An error occurred."}), 500
 
+@app.route('/admin/export/assessments', methods=['GET'])
+@admin_required
+def export_assessments(current_user):
+    """Stream assessments as NDJSON, optionally gzipped.
+
+    Query parameters: start/end (ISO dates, end exclusive), user_id (repeatable),
+    after_id to resume from a checkpoint, gzip=1 to compress.
+    """
+    try:
+        query = build_export_query(
+            parse_date(request.args.get('start')),
+            parse_date(request.args.get('end')),
+            request.args.getlist('user_id'),
+            request.args.get('after_id')
+        )
+    except Exception as e:
+        return jsonify({"message": f"Invalid export parameters: {str(e)}"}), 400
+
+    stream = iter_ndjson(iter_assessments(assessments_collection, query))
+    headers = {"Cache-Control": "no-store"}
+    if request.args.get('gzip') in ('1', 'true'):
+        stream = iter_gzip(stream)
+        headers["Content-Encoding"] = "gzip"
+
+    return Response(stream_with_context(stream), mimetype='application/x-ndjson', headers=headers)
+
+# Probes give up well before the driver's 30s server selection timeout
+READY_TIMEOUT = float(os.getenv("READY_TIMEOUT", 2))
+
+@app.route('/ready', methods=['GET'])
+def readiness():
+    """Readiness probe: connects to MongoDB if needed and pings it"""
+    try:
+        with pymongo.timeout(READY_TIMEOUT):
+            get_db().command('ping')
+        return jsonify({"status": "ready"})
+    except Exception as e:
+        return jsonify({"status": "unavailable", "message": str(e)}), 503
+
+@app.route('/metrics/write-queue', methods=['GET'])
+@admin_required
+def write_queue_metrics(current_user):
+    """Queue depth and flush statistics for the background write pipeline"""
+    return jsonify(write_queue.metrics())
+
 # Run the app
 if __name__ == '__main__':
     app.run(port=int(os.getenv("PORT", 5001)), debug=True)
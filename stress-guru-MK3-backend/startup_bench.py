@@ -0,0 +1,99 @@
+"""
+Cold start benchmark for the backend.
+
+Each measurement runs in a fresh interpreter so nothing is already imported
+or cached:
+- import time of twentyq_ai and server
+- time for the first authenticated /pss/history request after import, against
+  mongomock so the numbers don't depend on a Mongo server (includes the deferred
+  connect, the token lookup and starting the write queue)
+- parsing initial_patterns.json
+
+Usage:
+    python startup_bench.py --runs 10
+"""
+import sys
+import json
+import argparse
+import subprocess
+import statistics
+
+SNIPPETS = {
+    "import twentyq_ai": """
+import time
+start = time.perf_counter()
+import twentyq_ai
+print(time.perf_counter() - start)
+""",
+    "import server": """
+import time
+start = time.perf_counter()
+import server
+print(time.perf_counter() - start)
+""",
+    "first /pss/history": """
+import os, time, tempfile
+os.environ['WRITE_QUEUE_JOURNAL'] = os.path.join(tempfile.mkdtemp(), 'write_queue')
+import jwt, mongomock
+db = mongomock.MongoClient()['startup_bench']
+db['users'].insert_one({'email': 'bench@example.com'})
+import server
+server._db = db
+token = jwt.encode({'email': 'bench@example.com'}, server.app.config['SECRET_KEY'], algorithm='HS256')
+start = time.perf_counter()
+response = server.app.test_client().get('/pss/history', headers={'x-access-token': token})
+assert response.status_code == 200, response.status_code
+print(time.perf_counter() - start)
+""",
+    "parse initial patterns": """
+import time, json
+start = time.perf_counter()
+with open('initial_patterns.json') as f:
+    json.load(f)['patterns']
+print(time.perf_counter() - start)
+""",
+}
+
+
+def measure(snippet, runs):
+    samples = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, "-c", snippet], capture_output=True, text=True)
+        if result.returncode != 0:
+            return None, result.stderr.strip().splitlines()[-1] if result.stderr else "failed"
+        samples.append(float(result.stdout.strip().splitlines()[-1]) * 1000)
+    return samples, None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure backend import and first-request latency")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--json', action='store_true', help="Print results as JSON for tracking over time")
+    args = parser.parse_args()
+
+    results = {}
+    for name, snippet in SNIPPETS.items():
+        samples, error = measure(snippet, args.runs)
+        if error:
+            results[name] = {"error": error}
+        else:
+            results[name] = {
+                "median_ms": round(statistics.median(samples), 2),
+                "min_ms": round(min(samples), 2),
+                "max_ms": round(max(samples), 2)
+            }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'measurement':<26}{'median ms':>12}{'min ms':>10}{'max ms':>10}")
+    for name, stats in results.items():
+        if "error" in stats:
+            print(f"{name:<26}  error: {stats['error']}")
+        else:
+            print(f"{name:<26}{stats['median_ms']:>12.2f}{stats['min_ms']:>10.2f}{stats['max_ms']:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
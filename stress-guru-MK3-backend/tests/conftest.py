@@ -0,0 +1,82 @@
+import os
+import sys
+import time
+import datetime
+
+import pytest
+from pymongo.errors import AutoReconnect
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+mongomock = pytest.importorskip("mongomock")
+
+from write_queue import WriteQueue
+
+
+def wait_for_drain(queue, timeout=5):
+    """Block until the queue has flushed everything or the timeout passes"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if not queue.pending:
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class Flaky:
+    """Wraps a collection and makes the named method fail a number of times"""
+
+    def __init__(self, collection, method, failures, error=None, before=None):
+        self.collection = collection
+        self.method = method
+        self.failures = failures
+        self.error = error or AutoReconnect("connection lost")
+        self.before = before
+
+    def __getattr__(self, attr):
+        target = getattr(self.collection, attr)
+        if attr != self.method:
+            return target
+
+        def call(*args, **kwargs):
+            if self.failures:
+                self.failures -= 1
+                if self.before:
+                    self.before(*args, **kwargs)
+                raise self.error
+            return target(*args, **kwargs)
+        return call
+
+
+def make_queue(tmp_path, db, assessments=None, kbs=None, users=None, **kwargs):
+    kwargs.setdefault('flush_interval', 0.01)
+    queue = WriteQueue(
+        str(tmp_path / "write_queue"),
+        assessments if assessments is not None else db["stress_assessments"],
+        kbs if kbs is not None else db["ai_knowledge_base"],
+        users if users is not None else db["users"],
+        **kwargs
+    )
+    queue.ensure_started()
+    return queue
+
+
+def new_user(db):
+    return db["users"].insert_one({"email": "user@example.com"}).inserted_id
+
+
+def assessment(user_id, minutes=0):
+    return {
+        "user_id": str(user_id),
+        "timestamp": datetime.datetime(2024, 1, 1) + datetime.timedelta(minutes=minutes),
+        "responses": [[0, "never"]],
+        "score": 0,
+        "stress_level": "low stress",
+        "ai_confidence": 0.5,
+        "questions_answered": 1
+    }
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient()["stressguru_test"]
@@ -0,0 +1,59 @@
+import gzip
+import json
+import datetime
+
+from bson import ObjectId
+
+from export import build_export_query, ensure_indexes, export_to_file, read_checkpoint
+
+
+def seed(db, days=10):
+    collection = db["stress_assessments"]
+    for day in range(days):
+        timestamp = datetime.datetime(2024, 1, 1 + day, 12)
+        collection.insert_one({
+            "_id": ObjectId.from_datetime(timestamp),
+            "user_id": "a" if day % 2 else "b",
+            "timestamp": timestamp,
+            "score": day
+        })
+    return collection
+
+
+def read_rows(path):
+    with gzip.open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_date_and_user_filters(tmp_path, db):
+    collection = seed(db)
+    query = build_export_query(datetime.datetime(2024, 1, 3), datetime.datetime(2024, 1, 8), ["a"])
+    assert "$gte" in query["_id"] and "$lt" in query["_id"]
+
+    out = tmp_path / "export.ndjson.gz"
+    assert export_to_file(collection, str(out), query) == 2
+    assert [row["score"] for row in read_rows(out)] == [3, 5]
+
+
+def test_resume_from_checkpoint_has_no_duplicates(tmp_path, db):
+    collection = seed(db)
+    out = tmp_path / "export.ndjson.gz"
+    checkpoint = str(tmp_path / "export.ckpt")
+
+    # First run stops after a checkpoint, leaving a torn tail behind
+    first = seed(db.client["partial"], days=4)
+    export_to_file(first, str(out), build_export_query(), checkpoint_path=checkpoint, checkpoint_every=4)
+    with open(out, "ab") as f:
+        f.write(b"torn")
+
+    after_id, offset = read_checkpoint(checkpoint)
+    export_to_file(collection, str(out), build_export_query(after_id=after_id),
+                   checkpoint_path=checkpoint, resume_offset=offset)
+    assert [row["score"] for row in read_rows(out)] == list(range(10))
+
+
+def test_ensure_indexes_is_idempotent(db):
+    ensure_indexes(db)
+    ensure_indexes(db)
+    keys = [index["key"] for index in db["stress_assessments"].index_information().values()]
+    assert [("user_id", 1), ("_id", 1)] in keys
@@ -0,0 +1,101 @@
+import copy
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from global_prior import PriorAccumulator, merge_chunk, STRESS_LEVELS
+from twentyq_ai import AdaptiveStress20QAI, load_initial_patterns
+
+
+def learned_pattern(level="high stress", frequency=1):
+    return {
+        "responses": {str(q): "very often" for q in range(10)},
+        "stress_level": level,
+        "frequency": frequency
+    }
+
+
+def build(kb_pattern_lists):
+    acc = PriorAccumulator()
+    acc.add(merge_chunk(kb_pattern_lists), len(kb_pattern_lists))
+    return acc
+
+
+def test_untouched_seed_knowledge_bases_contribute_nothing():
+    fresh = [load_initial_patterns() for _ in range(3)]
+    fresh.append(AdaptiveStress20QAI().initialize_knowledge_base()["patterns"])
+    acc = build(fresh)
+    assert acc.level_counts.sum() == 0
+    assert acc.to_document()["representative_patterns"] == []
+
+
+def test_only_learned_frequency_and_new_patterns_count():
+    patterns = load_initial_patterns()
+    bumped = patterns[0]
+    bumped["frequency"] += 2
+    patterns.append(learned_pattern(frequency=3))
+
+    acc = build([patterns])
+    counts = dict(zip(STRESS_LEVELS, acc.level_counts))
+    assert counts[bumped["stress_level"]] >= 2
+    assert acc.level_counts.sum() == 5
+
+    reps = acc.to_document()["representative_patterns"]
+    assert {r["frequency"] for r in reps} == {2.0, 3.0}
+
+
+def test_prior_distribution_uses_representative_patterns():
+    never = dict(learned_pattern("low stress", 10), responses={str(q): "never" for q in range(10)})
+    prior = build([[never, learned_pattern("high stress", 10)]]).to_document()
+    # Representatives that disagree with the count tables pull the distribution their way
+    prior["representative_patterns"] = [{"responses": {"0": "never"}, "stress_level": "high stress", "frequency": 1}]
+    without_reps = dict(prior, representative_patterns=[])
+
+    ai = AdaptiveStress20QAI()
+    responses = [(q, "never") for q in range(3)]
+    ai.global_prior = without_reps
+    base = ai.prior_distribution(responses)
+    ai.global_prior = copy.deepcopy(prior)
+    blended = ai.prior_distribution(responses)
+
+    assert blended["high stress"] > base["high stress"]
+    assert sum(blended.values()) == pytest.approx(1.0)
+
+
+def partial_prior():
+    # 'low stress' learned from one-question patterns, 'high stress' from full ones
+    low = {"responses": {"0": "never"}, "stress_level": "low stress", "frequency": 1000}
+    return build([[low, learned_pattern("high stress", 10)]]).to_document()
+
+
+def test_level_without_data_never_wins():
+    ai = AdaptiveStress20QAI()
+    ai.global_prior = partial_prior()
+    for answer in ("never", "sometimes", "very often"):
+        dist = ai.prior_distribution([(q, answer) for q in range(4)])
+        assert dist["moderate stress"] == 0
+        assert max(dist, key=dist.get) != "moderate stress"
+    dist = ai.prior_distribution([(q, "never") for q in range(4)])
+    assert max(dist, key=dist.get) == "low stress"
+
+
+def test_empty_prior_is_ignored():
+    ai = AdaptiveStress20QAI()
+    ai.global_prior = build([load_initial_patterns()]).to_document()
+    assert ai.prior_distribution([(0, "very often")]) is None
+    responses = [(q, "very often") for q in range(10)]
+    assert ai.predict_stress_level(responses, user_assessments=0) == ai._predict_from_patterns(responses)
+
+
+def test_user_patterns_keep_a_share_of_the_vote():
+    ai = AdaptiveStress20QAI()
+    # The population says 'low stress' for answers the user's seeded KB calls 'high stress'
+    ai.global_prior = build([[learned_pattern("low stress", 1000), learned_pattern("high stress", 1)]]).to_document()
+    responses = [(q, "very often") for q in range(5)]
+    assert ai._predict_from_patterns(responses)[0] == "high stress"
+    assert ai.prior_distribution(responses)["low stress"] > 0.99
+
+    prediction, confidence = ai.predict_stress_level(responses, user_assessments=0)
+    assert prediction == "low stress"
+    assert confidence < ai.max_prior_weight + (1 - ai.max_prior_weight) / 2
@@ -0,0 +1,87 @@
+import datetime
+
+import jwt
+import pytest
+
+from conftest import Flaky, assessment, make_queue, wait_for_drain
+
+
+@pytest.fixture
+def server(tmp_path, db, monkeypatch):
+    monkeypatch.setenv("WRITE_QUEUE_JOURNAL", str(tmp_path / "server_queue"))
+    import server
+
+    monkeypatch.setattr(server, "_db", db)
+    for collection in (server.users_collection, server.assessments_collection,
+                       server.knowledge_base_collection, server.global_prior_collection):
+        monkeypatch.setattr(collection, "_collection", None)
+    return server
+
+
+def login(server, db):
+    user_id = db["users"].insert_one({"email": "user@example.com"}).inserted_id
+    token = jwt.encode({"email": "user@example.com"}, server.app.config['SECRET_KEY'], algorithm="HS256")
+    return user_id, {"x-access-token": token}
+
+
+def test_history_includes_queued_assessments(server, db, tmp_path, monkeypatch):
+    user_id, headers = login(server, db)
+    db["stress_assessments"].insert_one(assessment(user_id, minutes=0))
+
+    down = Flaky(db["stress_assessments"], "insert_many", failures=10 ** 6)
+    monkeypatch.setattr(server, "write_queue", make_queue(tmp_path, db, assessments=down))
+    server.write_queue.enqueue_assessment(assessment(user_id, minutes=5))
+
+    response = server.app.test_client().get('/pss/history', headers=headers)
+    history = response.get_json()["history"]
+    assert [entry["timestamp"] for entry in history] == ["2024-01-01T00:05:00", "2024-01-01T00:00:00"]
+    assert "_id" not in history[0]
+
+
+def test_etag_consistent_across_failed_flush(server, db, tmp_path, monkeypatch):
+    user_id, headers = login(server, db)
+    db["stress_assessments"].insert_one(assessment(user_id, minutes=0))
+    client = server.app.test_client()
+
+    monkeypatch.setattr(server, "write_queue", make_queue(tmp_path, db))
+    first = client.get('/pss/history', headers=headers)
+    old_etag = first.headers["ETag"]
+    assert client.get('/pss/history', headers={**headers, "If-None-Match": old_etag}).status_code == 304
+
+    # New assessment whose counter update fails once before it lands
+    users = Flaky(db["users"], "bulk_write", failures=1)
+    monkeypatch.setattr(server, "write_queue", make_queue(tmp_path, db, users=users))
+    server.write_queue.enqueue_assessment(assessment(user_id, minutes=5))
+
+    queued = client.get('/pss/history', headers={**headers, "If-None-Match": old_etag})
+    assert queued.status_code == 200
+    new_etag = queued.headers["ETag"]
+
+    assert wait_for_drain(server.write_queue)
+    user = db["users"].find_one({"_id": user_id})
+    assert user["assessment_count"] == 2
+    assert user["last_assessment_at"] == datetime.datetime(2024, 1, 1, 0, 5)
+
+    assert client.get('/pss/history', headers={**headers, "If-None-Match": old_etag}).status_code == 200
+    assert client.get('/pss/history', headers={**headers, "If-None-Match": new_etag}).status_code == 304
+
+
+def test_assess_backfills_count_for_older_users(server, db, tmp_path, monkeypatch):
+    user_id, headers = login(server, db)
+    for minutes in range(3):
+        db["stress_assessments"].insert_one(assessment(user_id, minutes=minutes))
+    monkeypatch.setattr(server, "write_queue", make_queue(tmp_path, db))
+
+    seen = []
+    predict = server.ai_system.predict_stress_level
+    def spy(responses, user_assessments=None):
+        seen.append(user_assessments)
+        return predict(responses, user_assessments)
+    monkeypatch.setattr(server.ai_system, "predict_stress_level", spy)
+
+    response = server.app.test_client().post(
+        '/pss/assess', headers=headers, json={"responses": [[0, "never"], [1, "sometimes"]]}
+    )
+    assert response.status_code == 200
+    assert seen == [3]
+    assert db["users"].find_one({"_id": user_id})["assessment_count"] >= 3
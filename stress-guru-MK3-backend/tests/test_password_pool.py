@@ -0,0 +1,53 @@
+import hmac
+import hashlib
+import threading
+
+import pytest
+
+pytest.importorskip("werkzeug")
+
+from password_pool import PasswordHashPool, HashPoolOverloaded
+
+
+@pytest.mark.parametrize("method", ["pbkdf2", "pbkdf2:sha256:1000", "scrypt"])
+def test_short_method_names_do_not_force_rehash(method):
+    pool = PasswordHashPool(method=method)
+    pwhash = pool.hash("secret")
+    assert pool.verify(pwhash, "secret")
+    assert not pool.needs_rehash(pwhash)
+
+
+@pytest.mark.parametrize("method", ["scrypt:16384:8", "argon2", "pbkdf2:nope"])
+def test_invalid_method_fails_fast(method):
+    with pytest.raises(ValueError):
+        PasswordHashPool(method=method)
+
+
+def test_legacy_sha256_hash_verifies_and_needs_rehash():
+    pool = PasswordHashPool(method="pbkdf2:sha256:1000")
+    digest = hmac.new(b"salt", b"secret", hashlib.sha256).hexdigest()
+    legacy = f"sha256$salt${digest}"
+    assert pool.verify(legacy, "secret")
+    assert not pool.verify(legacy, "wrong")
+    assert pool.needs_rehash(legacy)
+
+
+def test_full_pool_rejects():
+    pool = PasswordHashPool(method="pbkdf2:sha256:1000", workers=1, max_queue=0, retry_after=7)
+    holding = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        holding.set()
+        release.wait()
+
+    blocker = threading.Thread(target=pool._submit, args=(hold,))
+    blocker.start()
+    try:
+        assert holding.wait(5)
+        with pytest.raises(HashPoolOverloaded) as excinfo:
+            pool.hash("secret")
+        assert excinfo.value.retry_after == 7
+    finally:
+        release.set()
+        blocker.join()
@@ -0,0 +1,62 @@
+import os
+
+import pytest
+from flask import Flask, jsonify
+
+import profiling
+from profiling import profiled, rotate, timed
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_DIR", str(tmp_path / "profiles"))
+    monkeypatch.setattr(profiling, "PROFILE_TOKEN", "secret")
+    monkeypatch.setattr(profiling, "PROFILE_SAMPLE_RATE", 0.0)
+
+    app = Flask(__name__)
+
+    @app.route('/work')
+    @profiled
+    def work():
+        with timed('section'):
+            sum(range(1000))
+        return jsonify({"ok": True})
+
+    return app.test_client()
+
+
+def profiles_written():
+    if not os.path.isdir(profiling.PROFILE_DIR):
+        return []
+    return sorted(os.listdir(profiling.PROFILE_DIR))
+
+
+def test_valid_token_gets_server_timing(client):
+    response = client.get('/work', headers={"X-Profile-Token": "secret"})
+    assert response.headers["Server-Timing"].startswith("section;dur=")
+    assert [name.rsplit(".", 1)[1] for name in profiles_written()] == ["folded", "json"]
+
+
+def test_wrong_token_is_not_profiled(client):
+    response = client.get('/work', headers={"X-Profile-Token": "guess"})
+    assert "Server-Timing" not in response.headers
+    assert profiles_written() == []
+
+
+def test_sampled_requests_do_not_leak_timings(client, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_SAMPLE_RATE", 1.0)
+    response = client.get('/work')
+    assert "Server-Timing" not in response.headers
+    assert len(profiles_written()) == 2
+
+
+def test_rotate_removes_oldest_first(tmp_path):
+    for age, name in enumerate(["newest", "middle", "oldest"]):
+        path = tmp_path / name
+        path.write_bytes(b"x" * 10)
+        os.utime(path, (1000 - age, 1000 - age))
+
+    rotate(str(tmp_path), 20)
+    assert sorted(os.listdir(tmp_path)) == ["middle", "newest"]
+    rotate(str(tmp_path), 0)
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,171 @@
+import os
+import datetime
+
+import pytest
+from bson import ObjectId
+
+from write_queue import WriteQueueFull
+from conftest import Flaky, assessment, make_queue, new_user, wait_for_drain
+
+
+def crash(queue):
+    """Leave the queue's journal behind as if its process died"""
+    queue.stopping = True
+    queue.lock_file.close()
+
+
+def test_replay_after_crash(tmp_path, db):
+    user_id = new_user(db)
+    down = Flaky(db["stress_assessments"], "insert_many", failures=10 ** 6)
+    first = make_queue(tmp_path, db, assessments=down)
+    first.enqueue_assessment(assessment(user_id))
+    first.enqueue_knowledge_base({"user_id": str(user_id), "knowledge_base": {"patterns": []}})
+    crash(first)
+
+    second = make_queue(tmp_path, db)
+    assert second.journal_path == first.journal_path
+    assert wait_for_drain(second)
+
+    assert db["stress_assessments"].count_documents({}) == 1
+    assert db["ai_knowledge_base"].count_documents({"user_id": str(user_id)}) == 1
+    assert db["users"].find_one({"_id": user_id})["assessment_count"] == 1
+
+
+def test_no_duplicates_after_partial_insert_many(tmp_path, db):
+    user_id = new_user(db)
+    real = db["stress_assessments"]
+    partial = Flaky(real, "insert_many", failures=1, before=lambda docs, **kw: real.insert_many(docs[:2]))
+    queue = make_queue(tmp_path, db, assessments=partial)
+    for i in range(5):
+        queue.enqueue_assessment(assessment(user_id, minutes=i))
+    assert wait_for_drain(queue)
+
+    assert real.count_documents({}) == 5
+    user = db["users"].find_one({"_id": user_id})
+    assert user["assessment_count"] == 5
+    assert user["last_assessment_at"] == datetime.datetime(2024, 1, 1, 0, 4)
+
+
+def test_counters_survive_failed_user_update(tmp_path, db):
+    user_id = new_user(db)
+    users = Flaky(db["users"], "bulk_write", failures=1)
+    queue = make_queue(tmp_path, db, users=users)
+    queue.enqueue_assessment(assessment(user_id))
+    assert wait_for_drain(queue)
+
+    user = db["users"].find_one({"_id": user_id})
+    assert user["assessment_count"] == 1
+    assert user["last_assessment_at"] == datetime.datetime(2024, 1, 1)
+
+
+def test_pending_reads(tmp_path, db):
+    user_id = new_user(db)
+    down = Flaky(db["stress_assessments"], "insert_many", failures=10 ** 6)
+    queue = make_queue(tmp_path, db, assessments=down)
+    doc = assessment(user_id)
+    queue.enqueue_assessment(doc)
+    queue.enqueue_knowledge_base({"user_id": str(user_id), "knowledge_base": {"patterns": [1]}})
+
+    # The caller's dict can change afterwards without touching the queued copy
+    doc["score"] = 99
+    assert queue.pending_assessments(user_id)[0]["score"] == 0
+    assert queue.pending_knowledge_base(user_id)["knowledge_base"] == {"patterns": [1]}
+    assert queue.pending_assessments(ObjectId()) == []
+
+
+def test_max_depth(tmp_path, db):
+    user_id = new_user(db)
+    down = Flaky(db["stress_assessments"], "insert_many", failures=10 ** 6)
+    queue = make_queue(tmp_path, db, assessments=down, max_depth=2)
+    queue.enqueue_assessment(assessment(user_id))
+    queue.enqueue_assessment(assessment(user_id))
+    assert queue.is_full()
+    with pytest.raises(WriteQueueFull):
+        queue.enqueue_assessment(assessment(user_id))
+    assert queue.metrics()["rejected_total"] == 1
+
+
+def test_poison_write_is_dead_lettered(tmp_path, db):
+    user_id = new_user(db)
+    real = db["ai_knowledge_base"]
+
+    class RejectBadUser:
+        def __getattr__(self, attr):
+            return getattr(real, attr)
+
+        def bulk_write(self, ops, **kwargs):
+            if any(op._filter["user_id"] == "bad" for op in ops):
+                raise ValueError("document too large")
+            return real.bulk_write(ops, **kwargs)
+
+    queue = make_queue(tmp_path, db, kbs=RejectBadUser(), max_attempts=2)
+    queue.enqueue_knowledge_base({"user_id": "bad", "knowledge_base": {}})
+    queue.enqueue_knowledge_base({"user_id": str(user_id), "knowledge_base": {}})
+    queue.enqueue_assessment(assessment(user_id))
+    assert wait_for_drain(queue)
+
+    assert queue.metrics()["dead_lettered"] == 1
+    assert real.count_documents({"user_id": str(user_id)}) == 1
+    assert db["stress_assessments"].count_documents({}) == 1
+    with open(queue.dead_path) as f:
+        assert '"bad"' in f.read()
+
+
+def test_processes_get_separate_journals(tmp_path, db):
+    first = make_queue(tmp_path, db)
+    second = make_queue(tmp_path, db)
+    assert first.journal_path != second.journal_path
+
+
+def test_journal_is_compacted_under_load(tmp_path, db):
+    user_id = new_user(db)
+    queue = make_queue(tmp_path, db, batch_size=1, compact_bytes=1)
+    # Hold the worker back so there is always something pending when it acks
+    with queue.lock:
+        for i in range(20):
+            queue.seq += 1
+            queue._track({"seq": queue.seq, "kind": "assessment", "doc": assessment(user_id, minutes=i)})
+    queue.enqueue_assessment(assessment(user_id, minutes=30))
+    assert wait_for_drain(queue)
+    assert queue.metrics()["compactions"] > 0
+
+
+def test_orphaned_slots_are_adopted_after_scale_down(tmp_path, db):
+    user_id = new_user(db)
+    down = Flaky(db["stress_assessments"], "insert_many", failures=10 ** 6)
+    workers = [make_queue(tmp_path, db, assessments=down) for _ in range(4)]
+    for minutes, queue in enumerate(workers[2:]):
+        queue.enqueue_assessment(assessment(user_id, minutes=minutes))
+    for queue in workers:
+        crash(queue)
+
+    survivors = [make_queue(tmp_path, db) for _ in range(2)]
+    assert all(wait_for_drain(queue) for queue in survivors)
+
+    assert db["stress_assessments"].count_documents({}) == 2
+    assert db["users"].find_one({"_id": user_id})["assessment_count"] == 2
+    for queue in workers[2:]:
+        assert os.path.getsize(queue.journal_path) == 0
+
+
+def test_counters_use_one_aggregate_per_batch(tmp_path, db):
+    real = db["stress_assessments"]
+    calls = []
+
+    class Counting:
+        def __getattr__(self, attr):
+            if attr in ("aggregate", "count_documents"):
+                calls.append(attr)
+            return getattr(real, attr)
+
+    queue = make_queue(tmp_path, db, assessments=Counting(), flush_interval=0.2)
+    user_ids = [new_user(db) for _ in range(5)]
+    with queue.lock:
+        for user_id in user_ids:
+            queue.seq += 1
+            queue._track({"seq": queue.seq, "kind": "assessment", "doc": assessment(user_id)})
+        queue.wakeup.notify()
+    assert wait_for_drain(queue)
+
+    assert calls == ["aggregate"]
+    assert all(db["users"].find_one({"_id": u})["assessment_count"] == 1 for u in user_ids)
@@ -1,11 +1,22 @@
-import numpy as np
 from collections import defaultdict
-import joblib
 import warnings
 import os
 import json
 from math import log2
 
+INITIAL_PATTERNS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'initial_patterns.json')
+
+_initial_patterns_text = None
+
+def load_initial_patterns():
+    """Return a fresh copy of the initial pattern set; the file is read once per process"""
+    global _initial_patterns_text
+    if _initial_patterns_text is None:
+        with open(INITIAL_PATTERNS_PATH, 'r') as f:
+            _initial_patterns_text = f.read()
+    # Parsing per call gives every caller its own copy to mutate
+    return json.loads(_initial_patterns_text)['patterns']
+
 class AdaptiveStress20QAI:
     def __init__(self):
         warnings.filterwarnings('ignore')
@@ -43,6 +54,12 @@ class AdaptiveStress20QAI:
         # Historical data storage
         self.historical_data = []
 
+        # Population-wide prior built by global_prior.py, blended in by predict_stress_level
+        self.global_prior = None
+        self.prior_strength = 5.0
+        # The user's own patterns always keep at least 1 - max_prior_weight of the vote
+        self.max_prior_weight = 0.8
+
     def initialize_knowledge_base(self):
         """Initialize with some common stress pattern examples"""
         knowledge_base = {
@@ -190,17 +207,90 @@ class AdaptiveStress20QAI:
             except Exception:
                 return 0
 
-    def predict_stress_level(self, responses):
-        """Predict stress level using pattern matching and similarity scoring"""
+    def prior_distribution(self, responses):
+        """Stress level distribution for these responses under the global prior.
+
+        Naive Bayes over the prior's count tables, with add-one smoothing,
+        averaged with a similarity vote over its representative patterns when
+        any of them share a question with the responses. Each answer's
+        likelihood is relative to how often that question was answered under
+        the level, since most patterns only cover some questions. Levels with
+        no data get probability 0. Returns None when no prior is loaded or it
+        holds no data yet.
+        """
+        prior = self.global_prior
+        if not prior or sum(prior['level_counts']) <= 0:
+            return None
+
+        levels = prior['stress_levels']
+        answers = prior['answers']
+        level_counts = prior['level_counts']
+        table = prior['answer_counts']
+        total = sum(level_counts)
+
+        scores = []
+        for l, level_count in enumerate(level_counts):
+            if level_count <= 0:
+                scores.append(None)
+                continue
+            score = log2(level_count / total)
+            for idx, resp in responses:
+                if resp not in answers or not 0 <= int(idx) < len(table):
+                    continue
+                answered = sum(counts[l] for counts in table[int(idx)])
+                count = table[int(idx)][answers.index(resp)][l]
+                score += log2((count + 1) / (answered + len(answers)))
+            scores.append(score)
+
+        top = max(score for score in scores if score is not None)
+        weights = [0 if score is None else 2 ** (score - top) for score in scores]
+        norm = sum(weights)
+        dist = {level: weight / norm for level, weight in zip(levels, weights)}
+
+        votes, total_weight = self._pattern_votes(prior.get('representative_patterns') or [], responses)
+        if total_weight > 0:
+            dist = {level: (p + votes.get(level, 0) / total_weight) / 2 for level, p in dist.items()}
+        return dist
+
+    def predict_stress_level(self, responses, user_assessments=None):
+        """Predict stress level using pattern matching and similarity scoring.
+
+        If a global prior is loaded it is blended in, weighted by
+        prior_strength / (prior_strength + user_assessments) up to
+        max_prior_weight, so users with little history lean on the population
+        and long-time users on their own data.
+        """
         if not responses:
             return "moderate stress", 0.5
-            
+
+        prior_dist = self.prior_distribution(responses) if user_assessments is not None else None
+        if prior_dist:
+            user_prediction, user_confidence = self._predict_from_patterns(responses)
+            prior_weight = min(
+                self.max_prior_weight,
+                self.prior_strength / (self.prior_strength + max(0, user_assessments))
+            )
+            blended = {level: prior_weight * p for level, p in prior_dist.items()}
+            blended[user_prediction] = blended.get(user_prediction, 0) + (1 - prior_weight) * user_confidence
+
+            # Spread the rest of the user's confidence over the other levels
+            others = [level for level in prior_dist if level != user_prediction]
+            for level in others:
+                blended[level] += (1 - prior_weight) * (1 - user_confidence) / len(others)
+
+            prediction = max(blended.items(), key=lambda x: x[1])[0]
+            return prediction, blended[prediction]
+
+        return self._predict_from_patterns(responses)
+
+    def _pattern_votes(self, patterns, responses):
+        """Similarity and frequency weighted votes per stress level, and their total"""
         # Convert responses to dict format for easier matching
         current_responses = {str(idx): resp for idx, resp in responses}
         
         # Calculate similarity scores with known patterns
         pattern_scores = []
-        for pattern in self.knowledge_base['patterns']:
+        for pattern in patterns:
             score = 0
             matches = 0
             for idx, resp in current_responses.items():
@@ -212,9 +302,6 @@ class AdaptiveStress20QAI:
             if matches > 0:
                 similarity = score / matches
                 pattern_scores.append((similarity * pattern['frequency'], pattern['stress_level']))
-                
-        if not pattern_scores:
-            return self.calculate_traditional_score(responses)
             
         # Weight predictions by similarity and frequency
         stress_weights = defaultdict(float)
@@ -224,6 +311,11 @@ class AdaptiveStress20QAI:
             stress_weights[stress_level] += weight
             total_weight += weight
             
+        return stress_weights, total_weight
+
+    def _predict_from_patterns(self, responses):
+        """Similarity-weighted vote over the user's own knowledge base"""
+        stress_weights, total_weight = self._pattern_votes(self.knowledge_base['patterns'], responses)
         if total_weight == 0:
             return self.calculate_traditional_score(responses)
             
@@ -286,6 +378,7 @@ class AdaptiveStress20QAI:
             'historical_data': self.historical_data
         }
         try:
+            import joblib
             joblib.dump(model_data, filename)
             print(f"\nModel saved successfully to {filename}")
         except Exception as e:
@@ -297,6 +390,7 @@ class AdaptiveStress20QAI:
             return False
             
         try:
+            import joblib
             model_data = joblib.load(filename)
             self.knowledge_base = model_data['knowledge_base']
             self.question_weights = model_data['question_weights']
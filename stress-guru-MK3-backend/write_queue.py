@@ -0,0 +1,473 @@
+"""
+Background write pipeline for assessment persistence.
+
+/pss/assess hands its writes to a WriteQueue instead of waiting on Mongo.
+Every write is appended to an on-disk journal (fsynced) before the request
+returns, then a worker thread drains the queue in batches:
+
+- assessments go out as one insert_many, with client-side _ids so a replay
+  after a crash can't insert duplicates
+- knowledge base saves are coalesced per user (last write wins) into one
+  bulk_write of upserts
+- the per-user assessment_count/last_assessment_at used by the history
+  ETag are recomputed for every user in the batch with one aggregate and
+  applied with $max, so retrying a batch or replaying it after a crash
+  can't lose or double them
+
+Journals are per process. On start a queue claims the first free slot
+(write_queue.0.journal, write_queue.1.journal, ...) by locking its .lock file,
+and replays whatever a previous owner of that slot left un-acked. It then
+adopts the un-acked writes of every other slot nobody holds, so writes left
+behind by a worker that is gone after a scale-down still reach Mongo. The journal
+is truncated when the queue empties and compacted down to the un-acked
+entries once it grows past compact_bytes.
+
+The queue holds at most max_depth writes; beyond that enqueue raises
+WriteQueueFull so the server can answer 503. A write that keeps failing for a
+reason other than Mongo being unreachable is retried max_attempts times, then
+isolated from its batch and moved to the .dead file so it can't block the
+writes behind it.
+
+Writes that are still queued are visible through pending_assessments() and
+pending_knowledge_base(), which the server merges into its reads so a user
+always sees their own writes. That only holds within one process: with several
+workers, a user's requests must stick to one worker to read their own writes
+before the flush.
+"""
+import os
+import json
+import time
+import datetime
+import threading
+from collections import deque, defaultdict
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, ConnectionFailure
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+class WriteQueueFull(Exception):
+    """Raised when the queue is at max_depth"""
+
+    def __init__(self, retry_after):
+        super().__init__("Write queue is full")
+        self.retry_after = retry_after
+
+
+def _encode(value):
+    if isinstance(value, datetime.datetime):
+        return {"$date": value.isoformat()}
+    if isinstance(value, ObjectId):
+        return {"$oid": str(value)}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _decode(obj):
+    if len(obj) == 1:
+        if "$date" in obj:
+            return datetime.datetime.fromisoformat(obj["$date"])
+        if "$oid" in obj:
+            return ObjectId(obj["$oid"])
+    return obj
+
+
+def _read_journal(journal_path):
+    """Return (acked_seq, last seq, un-acked entries) for a journal file"""
+    ack_path = journal_path + ".ack"
+    acked_seq = 0
+    if os.path.exists(ack_path):
+        try:
+            with open(ack_path, 'r') as f:
+                acked_seq = int(f.read().strip() or 0)
+        except (ValueError, OSError) as e:
+            print(f"Write queue: could not read ack file: {str(e)}")
+
+    last_seq, entries = 0, []
+    if os.path.exists(journal_path):
+        with open(journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line, object_hook=_decode)
+                except ValueError:
+                    # Torn write at the tail of the journal
+                    continue
+                last_seq = max(last_seq, entry['seq'])
+                if entry['seq'] > acked_seq:
+                    entries.append(entry)
+    return acked_seq, last_seq, entries
+
+
+def _try_lock(f):
+    """Take an exclusive, non-blocking lock on an open file"""
+    try:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+class WriteQueue:
+    def __init__(self, journal_base, assessments_collection, knowledge_base_collection, users_collection,
+                 batch_size=500, flush_interval=0.5, max_depth=10000, max_attempts=5,
+                 compact_bytes=16 * 1024 * 1024, retry_after=2, max_slots=64):
+        self.journal_base = journal_base
+        self.assessments_collection = assessments_collection
+        self.knowledge_base_collection = knowledge_base_collection
+        self.users_collection = users_collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_depth = max_depth
+        self.max_attempts = max_attempts
+        self.compact_bytes = compact_bytes
+        self.retry_after = retry_after
+        self.max_slots = max_slots
+
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.pending = deque()
+        self.pending_by_user = defaultdict(list)
+        self.pending_kb = {}
+        self.seq = 0
+        self.acked_seq = 0
+        self.journal_path = None
+        self.ack_path = None
+        self.dead_path = None
+        self.lock_file = None
+        self.journal = None
+        self.worker = None
+        self.stopping = False
+
+        # Poison handling: attempts on the current head batch, and how many
+        # entries are left to send one at a time after a batch kept failing
+        self.attempts = 0
+        self.isolate_remaining = 0
+
+        # Metrics
+        self.enqueued_total = 0
+        self.written_total = 0
+        self.failed_batches = 0
+        self.dead_lettered = 0
+        self.rejected_total = 0
+        self.compactions = 0
+        self.last_batch_size = 0
+        self.last_flush_seconds = 0.0
+        self.last_error = None
+
+    # ---- lifecycle ----
+
+    def ensure_started(self):
+        """Claim a journal slot, replay it and start the worker on first use"""
+        if self.worker is not None:
+            return
+        with self.lock:
+            if self.worker is not None:
+                return
+            self._claim_slot()
+            self._replay()
+            self.journal = open(self.journal_path, 'a', encoding='utf-8')
+            self._adopt_orphans()
+            self.worker = threading.Thread(target=self._run, name="write-queue", daemon=True)
+            self.worker.start()
+
+    def _claim_slot(self):
+        for slot in range(self.max_slots):
+            base = f"{self.journal_base}.{slot}"
+            lock_file = open(base + ".lock", 'a')
+            if _try_lock(lock_file):
+                self.lock_file = lock_file
+                self.journal_path = base + ".journal"
+                self.ack_path = self.journal_path + ".ack"
+                self.dead_path = self.journal_path + ".dead"
+                return
+            lock_file.close()
+        raise RuntimeError(f"Write queue: all {self.max_slots} journal slots for {self.journal_base} are in use")
+
+    def stop(self, timeout=10):
+        """Stop the worker after one last drain attempt"""
+        if self.worker is None:
+            return
+        with self.lock:
+            self.stopping = True
+            self.wakeup.notify()
+        self.worker.join(timeout)
+
+    def _replay(self):
+        self.acked_seq, last_seq, entries = _read_journal(self.journal_path)
+        for entry in entries:
+            self._track(entry)
+        self.seq = max(last_seq, self.acked_seq)
+        if entries:
+            print(f"Write queue: replaying {len(entries)} journaled writes from {self.journal_path}")
+
+    def _adopt_orphans(self):
+        """Move the un-acked writes of every unheld slot into this queue. Caller holds self.lock."""
+        for slot in range(self.max_slots):
+            base = f"{self.journal_base}.{slot}"
+            journal_path = base + ".journal"
+            if journal_path == self.journal_path or not os.path.exists(journal_path):
+                continue
+            with open(base + ".lock", 'a') as lock_file:
+                if not _try_lock(lock_file):
+                    continue
+                _, _, entries = _read_journal(journal_path)
+                if not entries:
+                    continue
+                # Journal the writes here before dropping them there; a crash
+                # in between only replays them twice, which is idempotent
+                for entry in entries:
+                    self.seq += 1
+                    adopted = {"seq": self.seq, "kind": entry['kind'], "doc": entry['doc']}
+                    self.journal.write(json.dumps(adopted, default=_encode) + "\n")
+                    self._track(adopted)
+                self.journal.flush()
+                os.fsync(self.journal.fileno())
+                with open(journal_path, 'w'):
+                    pass
+                print(f"Write queue: adopted {len(entries)} journaled writes from {journal_path}")
+
+    # ---- producer side ----
+
+    def is_full(self):
+        return len(self.pending) >= self.max_depth
+
+    def enqueue_assessment(self, assessment):
+        assessment.setdefault('_id', ObjectId())
+        self._enqueue('assessment', assessment)
+
+    def enqueue_knowledge_base(self, kb_data):
+        self._enqueue('knowledge_base', kb_data)
+
+    def _enqueue(self, kind, doc):
+        self.ensure_started()
+        with self.lock:
+            if len(self.pending) >= self.max_depth:
+                self.rejected_total += 1
+                raise WriteQueueFull(self.retry_after)
+            self.seq += 1
+            line = json.dumps({"seq": self.seq, "kind": kind, "doc": doc}, default=_encode)
+            self.journal.write(line + "\n")
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+            # Track a decoded copy so later mutations by the caller don't leak in
+            self._track(json.loads(line, object_hook=_decode))
+            self.enqueued_total += 1
+            self.wakeup.notify()
+
+    def _track(self, entry):
+        self.pending.append(entry)
+        user_id = entry['doc']['user_id']
+        if entry['kind'] == 'assessment':
+            self.pending_by_user[user_id].append(entry['doc'])
+        else:
+            self.pending_kb[user_id] = entry
+
+    # ---- read-your-writes ----
+
+    def pending_assessments(self, user_id):
+        """Assessments for this user that haven't reached Mongo yet"""
+        self.ensure_started()
+        with self.lock:
+            return [dict(doc) for doc in self.pending_by_user.get(str(user_id), [])]
+
+    def pending_knowledge_base(self, user_id):
+        """Latest knowledge base save for this user that hasn't reached Mongo yet"""
+        self.ensure_started()
+        with self.lock:
+            entry = self.pending_kb.get(str(user_id))
+            return json.loads(json.dumps(entry['doc'], default=_encode), object_hook=_decode) if entry else None
+
+    def metrics(self):
+        self.ensure_started()
+        with self.lock:
+            oldest_age = 0.0
+            for entry in self.pending:
+                if entry['kind'] == 'assessment':
+                    oldest_age = (datetime.datetime.utcnow() - entry['doc']['timestamp']).total_seconds()
+                    break
+            try:
+                journal_bytes = os.path.getsize(self.journal_path)
+            except OSError:
+                journal_bytes = 0
+            return {
+                "journal": self.journal_path,
+                "journal_bytes": journal_bytes,
+                "queue_depth": len(self.pending),
+                "max_depth": self.max_depth,
+                "pending_assessments": sum(len(v) for v in self.pending_by_user.values()),
+                "pending_knowledge_bases": len(self.pending_kb),
+                "oldest_pending_assessment_seconds": round(oldest_age, 3),
+                "enqueued_total": self.enqueued_total,
+                "written_total": self.written_total,
+                "rejected_total": self.rejected_total,
+                "failed_batches": self.failed_batches,
+                "dead_lettered": self.dead_lettered,
+                "compactions": self.compactions,
+                "last_batch_size": self.last_batch_size,
+                "last_flush_seconds": round(self.last_flush_seconds, 4),
+                "last_error": self.last_error
+            }
+
+    # ---- consumer side ----
+
+    def _run(self):
+        backoff = self.flush_interval
+        while True:
+            with self.lock:
+                if not self.pending and not self.stopping:
+                    self.wakeup.wait(self.flush_interval)
+                if not self.pending and self.stopping:
+                    return
+                size = 1 if self.isolate_remaining else self.batch_size
+                batch = [self.pending[i] for i in range(min(size, len(self.pending)))]
+
+            if not batch:
+                continue
+
+            start = time.perf_counter()
+            try:
+                self._write_batch(batch)
+            except Exception as e:
+                print(f"Write queue: batch of {len(batch)} failed: {str(e)}")
+                with self.lock:
+                    self.failed_batches += 1
+                    self.last_error = str(e)
+                    if self.stopping:
+                        return
+                # An unreachable Mongo is retried until it comes back; anything
+                # else counts towards moving the write aside
+                if not isinstance(e, ConnectionFailure):
+                    self.attempts += 1
+                    if self.attempts >= self.max_attempts:
+                        self.attempts = 0
+                        if len(batch) > 1:
+                            self.isolate_remaining = len(batch)
+                        else:
+                            self._dead_letter(batch[0], e)
+                        continue
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+                continue
+
+            backoff = self.flush_interval
+            self.attempts = 0
+            if self.isolate_remaining:
+                self.isolate_remaining -= 1
+            self._ack(batch, time.perf_counter() - start)
+
+    def _write_batch(self, batch):
+        assessments = [entry['doc'] for entry in batch if entry['kind'] == 'assessment']
+
+        # Only the newest knowledge base per user needs writing
+        latest_kb = {}
+        for entry in batch:
+            if entry['kind'] == 'knowledge_base':
+                latest_kb[entry['doc']['user_id']] = entry['doc']
+
+        if assessments:
+            try:
+                self.assessments_collection.insert_many([dict(doc) for doc in assessments], ordered=False)
+            except BulkWriteError as e:
+                # Duplicates are rows an earlier attempt already inserted
+                errors = e.details.get('writeErrors', [])
+                if any(err.get('code') != DUPLICATE_KEY_ERROR for err in errors):
+                    raise
+
+            # Recount every user in the batch rather than $inc, so the step can
+            # be retried or replayed any number of times
+            latest = {}
+            for doc in assessments:
+                user_id = doc['user_id']
+                if user_id not in latest or doc['timestamp'] > latest[user_id]:
+                    latest[user_id] = doc['timestamp']
+
+            counts = {
+                row['_id']: row['count']
+                for row in self.assessments_collection.aggregate([
+                    {"$match": {"user_id": {"$in": list(latest)}}},
+                    {"$group": {"_id": "$user_id", "count": {"$sum": 1}}}
+                ])
+            }
+
+            self.users_collection.bulk_write([
+                UpdateOne(
+                    {"_id": ObjectId(user_id)},
+                    {"$max": {"assessment_count": counts.get(user_id, 0), "last_assessment_at": last}}
+                )
+                for user_id, last in latest.items()
+            ], ordered=False)
+
+        if latest_kb:
+            self.knowledge_base_collection.bulk_write([
+                UpdateOne({"user_id": user_id}, {"$set": kb_data}, upsert=True)
+                for user_id, kb_data in latest_kb.items()
+            ], ordered=False)
+
+    def _dead_letter(self, entry, error):
+        """Move a write that keeps failing out of the queue into the .dead file"""
+        print(f"Write queue: moving {entry['kind']} seq {entry['seq']} to {self.dead_path}: {str(error)}")
+        with open(self.dead_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({"error": str(error), **entry}, default=_encode) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        with self.lock:
+            self.dead_lettered += 1
+        if self.isolate_remaining:
+            self.isolate_remaining -= 1
+        self._ack([entry], 0.0, written=False)
+
+    def _ack(self, batch, elapsed, written=True):
+        with self.lock:
+            for entry in batch:
+                self.pending.popleft()
+                user_id = entry['doc']['user_id']
+                if entry['kind'] == 'assessment':
+                    user_pending = self.pending_by_user.get(user_id, [])
+                    if user_pending and user_pending[0] is entry['doc']:
+                        user_pending.pop(0)
+                    if not user_pending:
+                        self.pending_by_user.pop(user_id, None)
+                elif self.pending_kb.get(user_id) is entry:
+                    del self.pending_kb[user_id]
+
+            self.acked_seq = batch[-1]['seq']
+            if written:
+                self.written_total += len(batch)
+                self.last_batch_size = len(batch)
+                self.last_flush_seconds = elapsed
+                self.last_error = None
+
+            with open(self.ack_path, 'w') as f:
+                f.write(str(self.acked_seq))
+                f.flush()
+                os.fsync(f.fileno())
+
+            # Everything is durable in Mongo, so the journal can start over
+            if not self.pending:
+                self.journal.truncate(0)
+                self.journal.seek(0)
+            elif self.journal.tell() > self.compact_bytes:
+                self._compact()
+
+    def _compact(self):
+        """Rewrite the journal with only the un-acked entries. Caller holds self.lock."""
+        tmp_path = self.journal_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for entry in self.pending:
+                f.write(json.dumps(entry, default=_encode) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.journal.close()
+        os.replace(tmp_path, self.journal_path)
+        self.journal = open(self.journal_path, 'a', encoding='utf-8')
+        self.compactions += 1